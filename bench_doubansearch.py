@@ -0,0 +1,47 @@
+import os
+import sys
+import timeit
+
+# 豆瓣搜索结果解析基准：快速正则解析 vs BeautifulSoup完整解析
+# 用法：python bench_doubansearch.py [搜索结果html] [次数]
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.join(ROOT_DIR, "plugins", "doubanwatching")
+sys.path.insert(0, PLUGIN_DIR)
+
+from SearchParser import parse_first_subject, parse_subjects  # noqa: E402
+
+# 基准用的搜索结果页面放在插件目录外，不随插件安装下载
+FIXTURE = os.path.join(ROOT_DIR, "fixtures", "douban_search.html")
+
+
+def soup_first_subject(text: str):
+    for item in parse_subjects(text):
+        if item.get("subject_id"):
+            return item["title"], item["subject_id"]
+    return None
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else FIXTURE
+    number = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    print(f"INFO: {path} {len(text.encode('utf-8')) / 1024:.1f}KB，每种解析执行 {number} 次")
+
+    fast, soup = parse_first_subject(text), soup_first_subject(text)
+    print(f"INFO: 快速解析结果 {fast}，完整解析结果 {soup}")
+    if fast != soup:
+        print("ERROR: 两种解析结果不一致")
+        sys.exit(1)
+
+    results = {}
+    for name, func in (("快速解析", parse_first_subject), ("完整解析", soup_first_subject)):
+        seconds = min(timeit.repeat(lambda: func(text), number=number, repeat=3)) / number
+        results[name] = seconds
+        print(f"{name}: {seconds * 1000:.3f} ms/次")
+    print(f"快速解析提速 {results['完整解析'] / results['快速解析']:.1f} 倍")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,27 @@
+import datetime
+import os
 import threading
 from typing import List, Tuple, Dict, Any
 
+import pytz
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from app.core.config import settings
 from app.core.event import eventmanager, Event
 from app.plugins import _PluginBase
 from app.schemas import WebhookEventInfo
 from app.schemas.types import EventType
+from . import fingerprint
+from .job_queue import JobQueue
+from .marker_store import MarkerStore
 from .skip_helper import *
 from app.log import logger
 from app.core.meta import MetaBase
 
-handle_threading = []
-lock = threading.Lock()
-threading_event = threading.Event()
+# 后台任务线程数
+JOB_WORKERS = 2
+# 新集入库后查询新集item_id的间隔（秒），逐次退避，全部用完仍未查到则放弃
+NEW_EPISODE_DELAYS = [10, 20, 40, 80, 160, 300, 600]
 
 
 class AdaptiveIntroSkip(_PluginBase):
@@ -22,7 +32,7 @@ class AdaptiveIntroSkip(_PluginBase):
     # 插件图标
     plugin_icon = "https://raw.githubusercontent.com/honue/MoviePilot-Plugins/main/icons/chapter.png"
     # 插件版本
-    plugin_version = "1.7.7"
+    plugin_version = "1.9.0"
     # 插件作者
     plugin_author = "honue"
     # 作者主页
@@ -41,6 +51,18 @@ class AdaptiveIntroSkip(_PluginBase):
     _include: str = ''
     _exclude: str = ''
     _spec = ''
+    _path_map = ''
+    _include_matcher: KeywordMatcher = None
+    _exclude_matcher: KeywordMatcher = None
+    _spec_matcher: KeywordMatcher = None
+    # 特别指定规则 (关键词, 片头时间, 片尾时间, 是否指定时间点)
+    _spec_rules: List[Tuple[str, str, str, bool]] = []
+    _job_queue: JobQueue = None
+    _markers: MarkerStore = None
+    _scheduler: BackgroundScheduler = None
+    # 等待入库的新集 series_name -> 待标记信息
+    _waiting: Dict[str, dict] = {}
+    _waiting_lock = threading.Lock()
 
     def init_plugin(self, config: dict = None):
         if config:
@@ -53,10 +75,80 @@ class AdaptiveIntroSkip(_PluginBase):
             self._exclude = config.get("exclude") or ''
             # 特别指定开始 结束时间
             self._spec = config.get("spec") or ''
+            # 音频指纹分析 Emby路径与本地路径映射
+            self._path_map = config.get("path_map") or ''
+
+        # 预编译关键词与特别指定规则
+        self.__compile_rules()
+
+        # 停止现有任务
+        self.stop_service()
+
+        # 剧集标记存储，迁移旧版本以剧名为key的数据
+        self._markers = MarkerStore(self)
+        self._markers.migrate_legacy()
+
+        # 恢复上次未完成的任务
+        jobs = self.get_data('job_queue') or []
+        self._job_queue = JobQueue(handler=self.__handle_job, workers=JOB_WORKERS, on_change=self.__save_jobs)
+        self._job_queue.start()
+        for job in jobs:
+            self._job_queue.put(job)
+        if jobs:
+            logger.info(f"【任务队列】恢复 {len(jobs)} 个未完成任务")
+
+        # 恢复等待入库的新集
+        self._scheduler = BackgroundScheduler(timezone=settings.TZ)
+        self._scheduler.start()
+        self._waiting = self.get_data('new_episodes_waiting') or {}
+        for series_name, waiting in self._waiting.items():
+            self.__schedule_check(series_name, waiting.get("attempt", 0))
+
+    def __compile_rules(self):
+        """
+        预编译路径关键词和特别指定时间规则，配置有误时在配置阶段提示
+        """
+        self._include_matcher = KeywordMatcher([word for word in self._include.split(',') if word])
+        self._exclude_matcher = KeywordMatcher([word for word in self._exclude.split(',') if word])
+        rules = []
+        errors = []
+        for time_str in [self._begin_min, self._end_min]:
+            try:
+                self.trans_to_sec(time_str)
+            except ValueError:
+                errors.append(time_str)
+        for line in self._spec.split('\n'):
+            spec = line.strip()
+            if not spec:
+                continue
+            manual = spec.endswith('*')
+            if manual:
+                spec = spec[:-1]
+            parts = spec.split('#')
+            if len(parts) != 3 or not parts[0]:
+                errors.append(line)
+                continue
+            word, spec_begin, spec_end = parts
+            try:
+                self.trans_to_sec(spec_begin)
+                self.trans_to_sec(spec_end)
+            except ValueError:
+                errors.append(line)
+                continue
+            rules.append((word, spec_begin, spec_end, manual))
+        self._spec_rules = rules
+        self._spec_matcher = KeywordMatcher([rule[0] for rule in rules])
+        if errors:
+            msg = f"自适应IntroSkip 时间配置格式错误，已忽略：{'；'.join(errors)}"
+            logger.error(msg)
+            self.systemmessage.put(msg)
 
     @eventmanager.register(EventType.WebhookMessage)
     def hook(self, event: Event):
         event_info: WebhookEventInfo = event.event_data
+        if event_info.event == 'library.new':
+            self.__library_new(event_info)
+            return
         if event_info.event not in ['playback.unpause', 'playback.stop'] or event_info.media_type != 'Episode':
             # 'playback.pause' 'playback.start'
             return
@@ -65,13 +157,13 @@ class AdaptiveIntroSkip(_PluginBase):
             logger.info(f"{event_info.user_name} 不在用户列表 {self._user} 里")
             return
 
-        include_ret = include_keyword(event_info.item_path, self._include)
-        exclude_ret = exclude_keyword(event_info.item_path, self._exclude)
-        if not include_ret.get('ret') or not exclude_ret.get('ret'):
-            if not include_ret.get('ret'):
-                logger.info(f"{event_info.item_path} 不包含任何关键词 {self._include} 不标记片头片尾")
-            else:
-                logger.info(f"{event_info.item_path} 包含关键词 {exclude_ret.get('msg')} 不标记片头片尾")
+        path = event_info.item_path
+        if self._include_matcher and not self._include_matcher.search(path):
+            logger.info(f"{path} 不包含任何关键词 {self._include} 不标记片头片尾")
+            return
+        excluded = self._exclude_matcher.search(path)
+        if excluded:
+            logger.info(f"{path} 包含关键词 {self._exclude_matcher.keywords[min(excluded)]} 不标记片头片尾")
             return
 
         logger.debug(event_info)
@@ -79,129 +171,272 @@ class AdaptiveIntroSkip(_PluginBase):
         begin_time = self._begin_min
         end_time = self._end_min
 
-        # 特别指定时间
+        # 特别指定时间，多条规则命中时以最后一条为准
         manual = False
-        spec_conf = self._spec.split('\n') if self._spec else []
-        for spec in spec_conf[::-1]:
-            if spec.endswith('*'):
-                manual = True
-                spec = spec[:-1]
-            word, spec_begin, spec_end = spec.split('#')
-            if word in event_info.item_path:
-                begin_time = spec_begin
-                end_time = spec_end
-                if not manual:
-                    logger.info(f"受关键词 {word} 限定，片头最晚结束于{begin_time}，片尾最早开始于末尾{end_time}")
-                else:
-                    logger.info(f"受关键词 {word} 限定，片头结束于{begin_time}，片尾开始于-{end_time}")
-                break
+        matched = self._spec_matcher.search(path)
+        if matched:
+            word, begin_time, end_time, manual = self._spec_rules[max(matched)]
+            if not manual:
+                logger.info(f"受关键词 {word} 限定，片头最晚结束于{begin_time}，片尾最早开始于末尾{end_time}")
+            else:
+                logger.info(f"受关键词 {word} 限定，片头结束于{begin_time}，片尾开始于-{end_time}")
+
+        # 网络请求交给后台任务队列，webhook立即返回
+        space_idx = event_info.item_name.index(' S')
+        self._job_queue.put({
+            "key": f"{event_info.item_id}:{event_info.event}",
+            "series": event_info.item_id,
+            "type": "mark",
+            "series_name": event_info.item_name[:space_idx],
+            "item_id": event_info.item_id,
+            "item_name": event_info.item_name,
+            "user_name": event_info.user_name,
+            "season_id": event_info.season_id,
+            "episode_id": event_info.episode_id,
+            "percentage": event_info.percentage,
+            "event": event_info.event,
+            "begin_time": begin_time,
+            "end_time": end_time,
+            "manual": manual
+        })
+
+    @eventmanager.register(EventType.TransferComplete)
+    def episodes_hook(self, event: Event):
+        event_info: MetaBase = event.event_data.get("meta")
+        mediainfo = event.event_data.get("mediainfo")
+        series_name = mediainfo.title
+        # 有新文件入库，缓存的分集列表可能已过时
+        invalidate_episodes()
+
+        if not series_name:
+            return
+        chapter_info: dict = self._markers.find(series_name, mediainfo.tmdb_id)
+        if not chapter_info:
+            logger.info(f"【新集入库】{series_name} 没有设置过片头片尾信息，跳过")
+            return
+
+        logger.info(' ')
+        if event_info.total_episode > 5:
+            logger.info(f"【新集入库】本事件只处理追更订阅，跳过...")
+            return
+
+        # 短时间大量入库，同一剧集只等待一次，从最早的一集开始标记
+        with self._waiting_lock:
+            waiting = self._waiting.get(series_name)
+            if waiting and (waiting.get("season_id"), waiting.get("episode_id")) <= (event_info.begin_season,
+                                                                                     event_info.begin_episode):
+                logger.info(f'【新集入库】{series_name} 已在等待入库队列中')
+                return
+            self._waiting[series_name] = {
+                "series": chapter_info.get("series_id"),
+                "season_id": event_info.begin_season,
+                "episode_id": event_info.begin_episode,
+                "season_episode": event_info.season_episode,
+                "attempt": 0
+            }
+            self.save_data('new_episodes_waiting', self._waiting)
+        self.__schedule_check(series_name, 0)
+
+    def __library_new(self, event_info: WebhookEventInfo):
+        """
+        媒体服务器新入库通知，等待中的剧集立即查询新集
+        """
+        with self._waiting_lock:
+            series_names = [series_name for series_name, waiting in self._waiting.items()
+                            if str(waiting.get("series")) == str(event_info.item_id)
+                            or (event_info.item_name or '').startswith(f"{series_name} S")]
+        for series_name in series_names:
+            logger.info(f'【新集入库】{series_name} 收到媒体服务器入库通知，立即查询新集')
+            self.__enqueue_check(series_name)
+
+    def __schedule_check(self, series_name: str, attempt: int):
+        """
+        按退避间隔定时查询新集，同一剧集只保留一个定时任务
+        """
+        delay = NEW_EPISODE_DELAYS[min(attempt, len(NEW_EPISODE_DELAYS) - 1)]
+        logger.info(f'【新集入库】{series_name} {delay}s 后查询新集是否入库...')
+        self._scheduler.add_job(func=self.__enqueue_check, args=[series_name], trigger='date',
+                                run_date=datetime.datetime.now(tz=pytz.timezone(settings.TZ)) +
+                                         datetime.timedelta(seconds=delay),
+                                id=f"new:{series_name}", replace_existing=True,
+                                name=f"{series_name} 新集入库检查")
+
+    def __enqueue_check(self, series_name: str):
+        if not self._job_queue:
+            return
+        with self._waiting_lock:
+            waiting = self._waiting.get(series_name)
+        if not waiting:
+            return
+        self._job_queue.put({
+            "key": f"new:{series_name}",
+            "series": waiting.get("series"),
+            "type": "new_episodes",
+            "series_name": series_name
+        })
+
+    def __handle_job(self, job: dict):
+        """
+        后台任务入口
+        """
+        if job.get("type") == "mark":
+            return self.__mark_chapters(job)
+        if job.get("type") == "new_episodes":
+            return self.__mark_new_episodes(job)
+        if job.get("type") == "analyze":
+            return self.__analyze_season(job)
+        logger.warn(f"【任务队列】未知任务类型 {job.get('type')}")
+
+    def __mark_chapters(self, job: dict):
+        """
+        根据暂停、退出播放的位置，标记后续剧集的片头片尾
+        """
+        begin_time = job.get("begin_time")
+        end_time = job.get("end_time")
+        manual = job.get("manual")
+        item_name = job.get("item_name")
+        event = job.get("event")
 
         # 当前正在播放集的信息
-        current_percentage = event_info.percentage
-        current_video_item_id = get_current_video_item_id(item_id=event_info.item_id, season_id=event_info.season_id,
-                                                          episode_id=event_info.episode_id)
-        total_sec = get_total_time(current_video_item_id)
+        current_percentage = job.get("percentage")
+        current_episode = get_current_episode(item_id=job.get("item_id"), season_id=job.get("season_id"),
+                                              episode_id=job.get("episode_id"))
+        total_sec = get_episode_runtime(current_episode)
         current_sec = int(current_percentage / 100 * total_sec)
 
         if self.trans_to_sec(begin_time) < current_sec < (total_sec - self.trans_to_sec(end_time)):
             logger.info(
-                f"【不在时间段内】{event_info.item_name} {int(current_sec / 60)}分{int(current_sec % 60)}秒，不标记片头片尾")
+                f"【不在时间段内】{item_name} {int(current_sec / 60)}分{int(current_sec % 60)}秒，不标记片头片尾")
             return
 
         # 剧集在某集之后的所有剧集的item_id
-        next_episode_ids = get_next_episode_ids(item_id=event_info.item_id,
-                                                season_id=event_info.season_id,
-                                                episode_id=event_info.episode_id
+        next_episode_ids = get_next_episode_ids(item_id=job.get("item_id"),
+                                                season_id=job.get("season_id"),
+                                                episode_id=job.get("episode_id")
                                                 )
         if next_episode_ids:
-            # 存储最新片头位置，新集入库使用本数据
-            space_idx = event_info.item_name.index(' S')
-            series_name = event_info.item_name[:space_idx]
-            chapter_info = self.get_data(series_name) or {"item_id": event_info.item_id,
-                                                          "intro_end": 0,
-                                                          "credits_start": 0}
+            intro_end = None
+            credits_start = None
             # 当前播放时间（s）在[开始,begin_min]之间，且是暂停播放后，恢复播放的动作，标记片头
-            if (current_sec < self.trans_to_sec(begin_time) and event_info.event == 'playback.unpause') or manual:
+            if (current_sec < self.trans_to_sec(begin_time) and event == 'playback.unpause') or manual:
                 intro_end = self.trans_to_sec(begin_time) if manual else current_sec
-                # 批量标记之后的所有剧集，不影响已经看过的标记
-                for next_episode_id in next_episode_ids:
-                    update_intro(next_episode_id, intro_end)
-                chapter_info['intro_end'] = intro_end
-                logger.info(
-                    f"【恢复播放】{event_info.item_name} 后续剧集片头设置在 {int(intro_end / 60)}分{int(intro_end % 60)}秒 结束")
             # 当前播放时间（s）在[end_min,结束]之间，且是退出播放动作，标记片尾
             if (current_sec > (
-                    total_sec - self.trans_to_sec(end_time)) and event_info.event == 'playback.stop') or manual:
+                    total_sec - self.trans_to_sec(end_time)) and event == 'playback.stop') or manual:
                 credits_start = (total_sec - self.trans_to_sec(end_time)) if manual else current_sec
-                for next_episode_id in next_episode_ids:
-                    update_credits(next_episode_id, credits_start)
-                chapter_info['credits_start'] = credits_start
+            # 批量标记之后的所有剧集，不影响已经看过的标记
+            batch_update_chapters(next_episode_ids, intro_end=intro_end, credits_start=credits_start)
+            if intro_end is not None:
                 logger.info(
-                    f"【退出播放】{event_info.item_name} 后续剧集片尾设置在 {int(credits_start / 60)}分{int(credits_start % 60)}秒 开始")
-
-            self.save_data(series_name, chapter_info)
-
-    @eventmanager.register(EventType.TransferComplete)
-    def episodes_hook(self, event: Event):
-        event_info: MetaBase = event.event_data.get("meta")
-        series_name = event.event_data.get("mediainfo").title
-        chapter_info: dict = self.get_data(series_name) or {}
-
-        if not series_name:
-            return
-        if not chapter_info:
-            logger.info(f"【新集入库】{series_name} 没有设置过片头片尾信息，跳过")
-            return
+                    f"【恢复播放】{item_name} 后续剧集片头设置在 {int(intro_end / 60)}分{int(intro_end % 60)}秒 结束")
+            if credits_start is not None:
+                logger.info(
+                    f"【退出播放】{item_name} 后续剧集片尾设置在 {int(credits_start / 60)}分{int(credits_start % 60)}秒 开始")
+            # 存储最新片头位置，新集入库使用本数据
+            # 与入库媒体信息比对的是剧集的TMDB ID，webhook中的tmdb_id是单集的，不能使用
+            if intro_end is not None or credits_start is not None:
+                self._markers.save_marker(job.get("item_id"), job.get("series_name"), user=job.get("user_name"),
+                                          season=job.get("season_id"), episode=job.get("episode_id"),
+                                          intro_end=intro_end, credits_start=credits_start,
+                                          tmdb_id=get_series_tmdb_id(job.get("item_id")))
 
-        logger.info(' ')
-        if event_info.total_episode > 5:
-            logger.info(f"【新集入库】本事件只处理追更订阅，跳过...")
+    def __mark_new_episodes(self, job: dict):
+        """
+        查询新集是否已入库，已入库则按已保存的片头片尾位置标记，否则退避后再次查询
+        """
+        series_name = job.get("series_name")
+        with self._waiting_lock:
+            waiting = self._waiting.get(series_name)
+        chapter_info: dict = self._markers.get(waiting.get("series")) if waiting else {}
+        if not waiting or not chapter_info:
+            self.__finish_waiting(series_name)
             return
 
-        global handle_threading
-        # 短时间大量入库
-        with lock:
-            # 已加入待处理线程
-            if series_name in handle_threading:
-                logger.info(f'【新集入库】{series_name} 已在待处理队列中')
-                return
-            # 未加入待处理线程
-            else:
-                handle_threading.append(series_name)
-
-        with lock:
-            handle_threading.remove(series_name)
-
-        cnt = 1
-        while True:
-            logger.info(f'【新集入库】{series_name} 休眠10s，等待媒体入库...')
-            threading_event.wait(10)
-            # 新入库剧集的item_id
-            next_episode_ids = get_next_episode_ids(item_id=chapter_info.get("item_id"),
-                                                    season_id=event_info.begin_season,
-                                                    episode_id=event_info.begin_episode)
-            if next_episode_ids:
-                break
-            cnt += 1
-            if cnt >= 12:
+        # 有新集入库，分集缓存失效
+        invalidate_episodes(chapter_info.get("series_id"))
+        # 新入库剧集的item_id
+        next_episode_ids = get_next_episode_ids(item_id=chapter_info.get("series_id"),
+                                                season_id=waiting.get("season_id"),
+                                                episode_id=waiting.get("episode_id"))
+        if not next_episode_ids:
+            attempt = waiting.get("attempt", 0) + 1
+            if attempt >= len(NEW_EPISODE_DELAYS):
                 logger.error(f'【新集入库】长时间未查询到 {series_name} 最新集 item_id 放弃设定')
+                self.__finish_waiting(series_name)
                 return
+            with self._waiting_lock:
+                waiting["attempt"] = attempt
+                self.save_data('new_episodes_waiting', self._waiting)
+            self.__schedule_check(series_name, attempt)
+            return
 
+        self.__finish_waiting(series_name)
         logger.info(f'【新集入库】{series_name} 新入库剧集，item_id:{",".join(map(str, next_episode_ids))}')
 
         # 查询到item_id后
         # 批量标记新入库的剧集
         intro_end = chapter_info.get("intro_end")
-        for next_episode_id in next_episode_ids:
-            update_intro(next_episode_id, intro_end)
-        logger.info(
-            f"【新集入库】{series_name} {event_info.season_episode} ，片头设置在 {int(intro_end / 60)}分{int(intro_end % 60)}秒 结束")
-
         credits_start = chapter_info.get("credits_start")
-        for next_episode_id in next_episode_ids:
-            update_credits(next_episode_id, credits_start)
+        batch_update_chapters(next_episode_ids, intro_end=intro_end, credits_start=credits_start)
+        logger.info(
+            f"【新集入库】{series_name} {waiting.get('season_episode')} ，片头设置在 {int(intro_end / 60)}分{int(intro_end % 60)}秒 结束")
         logger.info(
-            f"【新集入库】{series_name} {event_info.season_episode} ，片尾设置在 {int(credits_start / 60)}分{int(intro_end % 60)}秒 开始")
+            f"【新集入库】{series_name} {waiting.get('season_episode')} ，片尾设置在 {int(credits_start / 60)}分{int(credits_start % 60)}秒 开始")
+
+    def __finish_waiting(self, series_name: str):
+        with self._waiting_lock:
+            if self._waiting.pop(series_name, None) is not None:
+                self.save_data('new_episodes_waiting', self._waiting)
+        if self._scheduler and self._scheduler.get_job(f"new:{series_name}"):
+            self._scheduler.remove_job(f"new:{series_name}")
+
+    def __analyze_season(self, job: dict):
+        """
+        音频指纹分析一季剧集的公共片头片尾，并标记到每一集
+        """
+        ok, msg = fingerprint.available()
+        if not ok:
+            logger.error(f"【指纹分析】无法分析：{msg}")
+            return
+        season_id = job.get("season_id")
+        episodes = [episode for episode in get_episodes(job.get("series"))
+                    if episode.get('ParentIndexNumber') == season_id and episode.get('Path')]
+        episodes.sort(key=lambda episode: episode.get('IndexNumber') or 0)
+        targets = []
+        for episode in episodes:
+            path = self.__local_path(episode['Path'])
+            if not os.path.exists(path):
+                logger.warn(f"【指纹分析】本地找不到文件 {path}，请检查路径映射")
+                continue
+            targets.append((episode['Id'], path, get_episode_runtime(episode)))
+        if len(targets) < 2:
+            logger.warn(f"【指纹分析】{job.get('series_name')} 第{season_id}季 可分析的剧集不足两集")
+            return
+        logger.info(f"【指纹分析】{job.get('series_name')} 第{season_id}季 开始分析 {len(targets)} 集...")
+        results = fingerprint.analyze_season(targets)
+        for item_id, result in results.items():
+            if result.get("intro_end") is None and result.get("credits_start") is None:
+                logger.info(f"【指纹分析】item_id:{item_id} 未找到公共片头片尾")
+                continue
+            update_chapters(item_id, intro_start=result.get("intro_start"), intro_end=result.get("intro_end"),
+                            credits_start=result.get("credits_start"))
+            logger.info(f"【指纹分析】item_id:{item_id} 片头 {result.get('intro_start')}-{result.get('intro_end')}秒 "
+                        f"片尾开始 {result.get('credits_start')}秒")
+
+    def __local_path(self, path: str) -> str:
+        """
+        Emby媒体路径转换为本地路径
+        """
+        for line in self._path_map.split('\n'):
+            if line.count('#') != 1:
+                continue
+            emby_path, local_path = line.strip().split('#')
+            if emby_path and path.startswith(emby_path):
+                return local_path + path[len(emby_path):]
+        return path
+
+    def __save_jobs(self, jobs: List[dict]):
+        self.save_data('job_queue', jobs)
 
     def trans_to_sec(self, time_str: str):
         if time_str.count(':'):
@@ -348,6 +583,29 @@ class AdaptiveIntroSkip(_PluginBase):
                             }
                         ]
                     },
+                    {
+                        'component': 'VRow',
+                        'content': [
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 12
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextarea',
+                                        'props': {
+                                            'model': 'path_map',
+                                            'rows': 2,
+                                            'label': '音频指纹分析路径映射',
+                                            'placeholder': '格式：Emby媒体路径#MoviePilot本地路径，一行一个。指纹分析需要安装ffmpeg与numpy，通过API /analyze?item_id=剧集id&season=季 触发。',
+                                        }
+                                    }
+                                ]
+                            }
+                        ]
+                    },
                     {
                         'component': 'VRow',
                         'content': [
@@ -362,7 +620,7 @@ class AdaptiveIntroSkip(_PluginBase):
                                         'props': {
                                             'type': 'warning',
                                             'variant': 'tonal',
-                                            'text': 'Supported by ChapterAPI, 目前只支持Emby, Emby需要安装ChapterAPI插件，需要在emby通知中添加mp的回调webhook。v1.6遇到问题请重置插件'
+                                            'text': 'Supported by ChapterAPI, 目前只支持Emby, Emby需要安装ChapterAPI插件，需要在emby通知中添加mp的回调webhook，勾选「新媒体已添加」事件可在新集入库后立即标记。v1.6遇到问题请重置插件'
                                         }
                                     }
                                 ]
@@ -415,6 +673,7 @@ class AdaptiveIntroSkip(_PluginBase):
             "include": '',
             "exclude": '',
             "spec": '',
+            "path_map": '',
             "user": ''
         }
 
@@ -422,13 +681,128 @@ class AdaptiveIntroSkip(_PluginBase):
         return self._enable
 
     def get_page(self) -> List[dict]:
-        pass
+        """
+        拼装插件详情页面，展示各剧集当前的片头片尾标记
+        """
+        markers = sorted(self._markers.get_many().values() if self._markers else [],
+                         key=lambda marker: marker.get("updated") or "", reverse=True)
+        if not markers:
+            return [
+                {
+                    'component': 'div',
+                    'text': '暂无数据',
+                    'props': {
+                        'class': 'text-center',
+                    }
+                }
+            ]
+        rows = []
+        for marker in markers:
+            last = (marker.get("history") or [{}])[-1]
+            intro_end = marker.get("intro_end") or 0
+            credits_start = marker.get("credits_start") or 0
+            rows.append({
+                'component': 'tr',
+                'content': [
+                    {'component': 'td', 'text': marker.get("series_name")},
+                    {'component': 'td', 'text': f"{int(intro_end / 60)}分{int(intro_end % 60)}秒"},
+                    {'component': 'td', 'text': f"{int(credits_start / 60)}分{int(credits_start % 60)}秒"},
+                    {'component': 'td', 'text': last.get("user") or ''},
+                    {'component': 'td', 'text': marker.get("updated") or ''}
+                ]
+            })
+        return [
+            {
+                'component': 'VTable',
+                'props': {
+                    'hover': True
+                },
+                'content': [
+                    {
+                        'component': 'thead',
+                        'content': [
+                            {
+                                'component': 'tr',
+                                'content': [{'component': 'th', 'text': text} for text in
+                                            ['剧集', '片头结束', '片尾开始', '设置用户', '更新时间']]
+                            }
+                        ]
+                    },
+                    {
+                        'component': 'tbody',
+                        'content': rows
+                    }
+                ]
+            }
+        ]
 
     def stop_service(self):
-        pass
+        if self._scheduler:
+            self._scheduler.remove_all_jobs()
+            if self._scheduler.running:
+                self._scheduler.shutdown()
+            self._scheduler = None
+        if self._job_queue:
+            self._job_queue.stop()
+            self._job_queue = None
 
-    def get_api(self):
-        pass
+    def get_api(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "path": "/jobs",
+                "endpoint": self.api_jobs,
+                "methods": ["GET"],
+                "summary": "任务队列状态",
+                "description": "查询片头片尾标记任务的排队、执行情况"
+            },
+            {
+                "path": "/markers",
+                "endpoint": self.api_markers,
+                "methods": ["GET"],
+                "summary": "剧集标记",
+                "description": "批量查询剧集的片头片尾标记及历史，参数 series_ids 为逗号分隔的剧集id，留空返回全部"
+            },
+            {
+                "path": "/analyze",
+                "endpoint": self.api_analyze,
+                "methods": ["GET"],
+                "summary": "音频指纹分析",
+                "description": "离线分析一季剧集的公共片头片尾并标记，参数 item_id 为剧集id，season 为季"
+            }
+        ]
+
+    def api_jobs(self):
+        """
+        API: 任务队列状态
+        """
+        if not self._job_queue:
+            return {"code": 500, "message": "任务队列未运行"}
+        return {"code": 0, "data": self._job_queue.status()}
+
+    def api_markers(self, series_ids: str = None):
+        """
+        API: 批量查询剧集标记
+        """
+        ids = [series_id for series_id in series_ids.split(',') if series_id] if series_ids else None
+        return {"code": 0, "data": self._markers.get_many(ids)}
+
+    def api_analyze(self, item_id: str, season: int):
+        """
+        API: 音频指纹分析
+        """
+        ok, msg = fingerprint.available()
+        if not ok:
+            return {"code": 400, "message": msg}
+        if not self._job_queue:
+            return {"code": 500, "message": "任务队列未运行"}
+        self._job_queue.put({
+            "key": f"analyze:{item_id}:{season}",
+            "series": item_id,
+            "type": "analyze",
+            "series_name": item_id,
+            "season_id": int(season)
+        })
+        return {"code": 0, "message": "分析任务已加入队列"}
 
     def get_command(self):
         pass
@@ -0,0 +1,179 @@
+import os
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 解码采样率
+SAMPLE_RATE = 11025
+# 帧长与帧移，帧移约0.124秒
+FRAME_SIZE = 4096
+HOP_SIZE = 1365
+# 频带数，相邻频带能量差得到32位指纹
+BANDS = 33
+BAND_MIN_FREQ = 300
+BAND_MAX_FREQ = 2000
+# 每次FFT的帧数，控制内存占用
+FFT_CHUNK = 256
+# 片头在开头多少秒内查找，片尾在末尾多少秒内查找
+INTRO_WINDOW = 300
+CREDITS_WINDOW = 240
+# 两帧指纹不同的位数不超过该值视为相同
+MAX_BIT_ERRORS = 10
+# 公共片段最短时长（秒）
+MIN_SEGMENT_SEC = 15
+# 平滑窗口（帧），容忍零星的不匹配帧
+SMOOTH_FRAMES = 8
+
+
+def available() -> Tuple[bool, str]:
+    """
+    检查音频指纹分析依赖
+    """
+    if np is None:
+        return False, "未安装numpy"
+    if not shutil.which("ffmpeg"):
+        return False, "未找到ffmpeg"
+    return True, ""
+
+
+def frames_to_sec(frames: int) -> float:
+    return frames * HOP_SIZE / SAMPLE_RATE
+
+
+def decode_audio(path: str, start: float, duration: float) -> "np.ndarray":
+    """
+    ffmpeg 解码一段音频为单声道浮点采样
+    """
+    cmd = ["ffmpeg", "-nostdin", "-v", "error", "-ss", str(max(0, start)), "-t", str(duration),
+           "-i", path, "-vn", "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "-"]
+    ret = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=600, check=True)
+    return np.frombuffer(ret.stdout, dtype="<i2").astype(np.float32) / 32768
+
+
+def compute_fingerprint(samples: "np.ndarray") -> "np.ndarray":
+    """
+    计算类chromaprint指纹，每帧一个uint32，每一位为相邻频带能量差在时间上的变化方向
+    """
+    n_frames = 1 + (len(samples) - FRAME_SIZE) // HOP_SIZE if len(samples) >= FRAME_SIZE else 0
+    if n_frames < 2:
+        return np.zeros(0, dtype=np.uint32)
+    window = np.hanning(FRAME_SIZE).astype(np.float32)
+    freqs = np.fft.rfftfreq(FRAME_SIZE, 1 / SAMPLE_RATE)
+    edges = np.geomspace(BAND_MIN_FREQ, BAND_MAX_FREQ, BANDS + 1)
+    band_idx = np.digitize(freqs, edges) - 1
+    valid = (band_idx >= 0) & (band_idx < BANDS)
+    energies = np.empty((n_frames, BANDS), dtype=np.float64)
+    for chunk_start in range(0, n_frames, FFT_CHUNK):
+        chunk_frames = np.arange(chunk_start, min(n_frames, chunk_start + FFT_CHUNK))
+        idx = chunk_frames[:, None] * HOP_SIZE + np.arange(FRAME_SIZE)[None, :]
+        spectrum = np.abs(np.fft.rfft(samples[idx] * window, axis=1)) ** 2
+        chunk_energy = np.zeros((len(chunk_frames), BANDS), dtype=np.float64)
+        np.add.at(chunk_energy.T, band_idx[valid], spectrum[:, valid].T)
+        energies[chunk_frames] = chunk_energy
+    band_diff = np.diff(energies, axis=1)
+    bits = (band_diff[1:] - band_diff[:-1]) > 0
+    weights = np.left_shift(np.uint64(1), np.arange(BANDS - 1, dtype=np.uint64))
+    return (bits.astype(np.uint64) * weights).sum(axis=1).astype(np.uint32)
+
+
+def popcount(values: "np.ndarray") -> "np.ndarray":
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 4), axis=1).sum(axis=1)
+
+
+def longest_run(flags: "np.ndarray") -> Tuple[int, int]:
+    """
+    最长连续True区间 (起点, 长度)
+    """
+    if not flags.any():
+        return 0, 0
+    padded = np.concatenate(([0], flags.astype(np.int8), [0]))
+    changes = np.flatnonzero(np.diff(padded))
+    starts, ends = changes[::2], changes[1::2]
+    longest = int(np.argmax(ends - starts))
+    return int(starts[longest]), int(ends[longest] - starts[longest])
+
+
+def find_common_segment(fp_a: "np.ndarray", fp_b: "np.ndarray") -> Optional[Tuple[int, int, int]]:
+    """
+    对两段指纹做互相关，找出最长的公共片段
+    :return: 公共片段在 fp_a 中的起始帧，在 fp_b 中的起始帧，长度（帧）
+    """
+    min_frames = int(MIN_SEGMENT_SEC * SAMPLE_RATE / HOP_SIZE)
+    kernel = np.ones(SMOOTH_FRAMES) / SMOOTH_FRAMES
+    best = None
+    # fp_a[i] 对齐 fp_b[i - offset]
+    for offset in range(-(len(fp_b) - min_frames), len(fp_a) - min_frames + 1):
+        a_start = max(0, offset)
+        b_start = max(0, -offset)
+        length = min(len(fp_a) - a_start, len(fp_b) - b_start)
+        if length < min_frames:
+            continue
+        errors = popcount(fp_a[a_start:a_start + length] ^ fp_b[b_start:b_start + length])
+        matched = np.convolve(errors <= MAX_BIT_ERRORS, kernel, mode="same") >= 0.5
+        run_start, run_length = longest_run(matched)
+        if run_length >= min_frames and (best is None or run_length > best[2]):
+            best = (a_start + run_start, b_start + run_start, run_length)
+    return best
+
+
+def fingerprint_episode(path: str, runtime: float) -> Tuple["np.ndarray", "np.ndarray", float]:
+    """
+    计算单集开头、结尾窗口的指纹，在子进程中执行
+    :return: 片头窗口指纹，片尾窗口指纹，片尾窗口起点（秒）
+    """
+    intro_fp = compute_fingerprint(decode_audio(path, 0, INTRO_WINDOW))
+    if not runtime:
+        # 时长未知时无法定位结尾窗口，不分析片尾
+        return intro_fp, np.zeros(0, dtype=np.uint32), 0.0
+    credits_offset = max(0.0, runtime - CREDITS_WINDOW)
+    credits_fp = compute_fingerprint(decode_audio(path, credits_offset, CREDITS_WINDOW))
+    return intro_fp, credits_fp, credits_offset
+
+
+def compare_pair(fp_a: tuple, fp_b: tuple) -> Tuple[Optional[tuple], Optional[tuple]]:
+    """
+    比较相邻两集的片头、片尾窗口指纹，在子进程中执行
+    :param fp_a: fingerprint_episode 的返回值
+    :return: 片头公共片段，片尾公共片段，均为 find_common_segment 的返回值
+    """
+    intro = find_common_segment(fp_a[0], fp_b[0])
+    credits = find_common_segment(fp_a[1], fp_b[1]) if len(fp_a[1]) and len(fp_b[1]) else None
+    return intro, credits
+
+
+def analyze_season(episodes: List[Tuple[str, str, float]], workers: int = None) -> Dict[str, dict]:
+    """
+    分析一季剧集的公共片头片尾，指纹计算在进程池中并行执行
+    :param episodes: [(item_id, 本地路径, 时长秒)]，按集数排序
+    :return: item_id -> {"intro_start": 秒或None, "intro_end": 秒或None, "credits_start": 秒或None}
+    """
+    if len(episodes) < 2:
+        return {}
+    workers = workers or max(1, min(len(episodes), (os.cpu_count() or 2) - 1))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        fingerprints = list(executor.map(fingerprint_episode,
+                                         [path for _, path, _ in episodes],
+                                         [runtime for _, _, runtime in episodes]))
+        # 每对相邻集只比较一次，结果同时用于两集
+        pairs = list(executor.map(compare_pair, fingerprints[:-1], fingerprints[1:]))
+    # item_id -> [片头长度, 片头开始, 片头结束, 片尾长度, 片尾开始]，与前后相邻集比较取最长的公共片段
+    best = {item_id: [0, None, None, 0, None] for item_id, _, _ in episodes}
+    for idx, (intro, credits) in enumerate(pairs):
+        for side, pos in ((idx, 0), (idx + 1, 1)):
+            item_id = episodes[side][0]
+            if intro and intro[2] > best[item_id][0]:
+                best[item_id][0] = intro[2]
+                # 片头前可能有冷开场，开始位置不一定是0
+                best[item_id][1] = int(frames_to_sec(intro[pos]))
+                best[item_id][2] = int(frames_to_sec(intro[pos] + intro[2]))
+            if credits and credits[2] > best[item_id][3]:
+                best[item_id][3] = credits[2]
+                best[item_id][4] = int(fingerprints[side][2] + frames_to_sec(credits[pos]))
+    return {item_id: {"intro_start": intro_start, "intro_end": intro_end, "credits_start": credits_start}
+            for item_id, (_, intro_start, intro_end, _, credits_start) in best.items()}
@@ -0,0 +1,123 @@
+import queue
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from app.log import logger
+
+
+class JobQueue:
+    """
+    片头片尾标记后台任务队列
+    同一个key的待处理任务以新任务为准，同一剧集的任务固定由同一个工作线程按顺序执行
+    handler抛出异常视为任务失败，停止时未执行完的任务由stop保存，下次启动时恢复
+    """
+
+    def __init__(self, handler: Callable[[dict], None], workers: int = 2,
+                 on_change: Optional[Callable[[List[dict]], None]] = None):
+        self._handler = handler
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        # 待处理任务 key -> job
+        self._pending: Dict[str, dict] = {}
+        # 执行中任务 key -> job
+        self._running: Dict[str, dict] = {}
+        self._queues = [queue.Queue() for _ in range(max(1, workers))]
+        self._threads: List[threading.Thread] = []
+        self._stats = {"done": 0, "failed": 0, "merged": 0}
+        self._history = deque(maxlen=20)
+
+    def start(self):
+        self._stop_event.clear()
+        for idx, q in enumerate(self._queues):
+            thread = threading.Thread(target=self._worker, args=(q,), name=f"AdaptiveIntroSkip-{idx}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5):
+        self._stop_event.set()
+        # 保存一次未完成的任务（含执行中的，下次启动时重新执行），之后不再持久化，
+        # 避免等待超时仍在运行的线程覆盖新队列保存的任务
+        self._notify()
+        self._on_change = None
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+
+    @property
+    def stopping(self) -> bool:
+        return self._stop_event.is_set()
+
+    def put(self, job: dict) -> bool:
+        """
+        加入任务，job需包含key与series，已有同key待处理任务时替换为新任务，返回是否为新任务
+        """
+        key = job["key"]
+        job.setdefault("created", time.strftime("%Y-%m-%d %H:%M:%S"))
+        with self._lock:
+            old_job = self._pending.get(key)
+            self._pending[key] = job
+            if old_job:
+                self._stats["merged"] += 1
+        if old_job:
+            logger.info(f"【任务队列】{key} 已在队列中，合并任务")
+        else:
+            self._queues[self._slot(job["series"])].put(key)
+        self._notify()
+        return not old_job
+
+    def snapshot(self) -> List[dict]:
+        """
+        未完成的任务，用于持久化
+        """
+        with self._lock:
+            return list(self._running.values()) + list(self._pending.values())
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "workers": len(self._threads),
+                "pending": list(self._pending.values()),
+                "running": list(self._running.values()),
+                "stats": dict(self._stats),
+                "history": list(self._history)
+            }
+
+    def _slot(self, series) -> int:
+        return zlib.crc32(str(series).encode("utf-8")) % len(self._queues)
+
+    def _notify(self):
+        if self._on_change:
+            try:
+                self._on_change(self.snapshot())
+            except Exception as e:
+                logger.error(f"【任务队列】保存任务失败：{str(e)}")
+
+    def _worker(self, q: queue.Queue):
+        while not self._stop_event.is_set():
+            key = q.get()
+            if key is None:
+                break
+            with self._lock:
+                job = self._pending.pop(key, None)
+                if job:
+                    self._running[key] = job
+            if not job:
+                continue
+            ret = "done"
+            try:
+                self._handler(job)
+            except Exception as e:
+                ret = "failed"
+                logger.error(f"【任务队列】{key} 执行失败：{str(e)}")
+            with self._lock:
+                self._running.pop(key, None)
+                self._stats[ret] += 1
+                self._history.append({"key": key, "result": ret,
+                                      "finished": time.strftime("%Y-%m-%d %H:%M:%S")})
+            self._notify()
@@ -0,0 +1,138 @@
+import json
+import threading
+import time
+from typing import Dict, List, Optional
+
+from app.log import logger
+
+# 每个剧集保留的历史记录条数
+HISTORY_LIMIT = 50
+# 插件数据key前缀
+KEY_PREFIX = "series:"
+# 不是标记数据的插件数据key
+RESERVED_KEYS = {"job_queue", "new_episodes_waiting"}
+
+
+class MarkerStore:
+    """
+    片头片尾标记存储，按Emby剧集ID保存，每个剧集一条插件数据，包含当前标记与历史
+    {
+        "series_id": "123",
+        "series_name": "剧名",
+        "tmdb_id": 456,
+        "intro_end": 90,
+        "credits_start": 1320,
+        "updated": "2024-01-01 00:00:00",
+        "history": [{"time", "user", "season", "episode", "intro_end", "credits_start", "source"}]
+    }
+    """
+
+    def __init__(self, plugin):
+        self._plugin = plugin
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(series_id) -> str:
+        return f"{KEY_PREFIX}{series_id}"
+
+    def get(self, series_id) -> dict:
+        if not series_id:
+            return {}
+        return self._plugin.get_data(self._key(series_id)) or {}
+
+    def get_many(self, series_ids: List = None) -> Dict[str, dict]:
+        """
+        一次查询读取多个剧集的标记，不指定series_ids时返回全部
+        """
+        wanted = {str(series_id) for series_id in series_ids} if series_ids is not None else None
+        markers = {}
+        for key, value in self._all_data():
+            if not key.startswith(KEY_PREFIX):
+                continue
+            series_id = key[len(KEY_PREFIX):]
+            if wanted is not None and series_id not in wanted:
+                continue
+            markers[series_id] = value
+        return markers
+
+    def find(self, series_name: str, tmdb_id=None) -> dict:
+        """
+        新集入库时按tmdb_id或剧名查找剧集标记，重名时优先tmdb_id匹配，其次最近更新的
+        """
+        candidates = [marker for marker in self.get_many().values() if marker.get("series_name") == series_name
+                      or (tmdb_id and str(marker.get("tmdb_id")) == str(tmdb_id))]
+        if not candidates:
+            return {}
+        if tmdb_id:
+            same_tmdb = [marker for marker in candidates if str(marker.get("tmdb_id")) == str(tmdb_id)]
+            if same_tmdb:
+                candidates = same_tmdb
+        return max(candidates, key=lambda marker: marker.get("updated") or "")
+
+    def save_marker(self, series_id, series_name: str, user: str = None, season: int = None, episode: int = None,
+                    intro_end: Optional[int] = None, credits_start: Optional[int] = None,
+                    tmdb_id=None, source: str = "playback") -> dict:
+        """
+        更新剧集标记并追加历史
+        """
+        now = time.strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            marker = self.get(series_id) or {"series_id": str(series_id), "intro_end": 0, "credits_start": 0,
+                                             "history": []}
+            marker["series_name"] = series_name
+            if tmdb_id:
+                marker["tmdb_id"] = tmdb_id
+            if intro_end is not None:
+                marker["intro_end"] = intro_end
+            if credits_start is not None:
+                marker["credits_start"] = credits_start
+            marker["updated"] = now
+            marker["history"] = (marker.get("history") or []) + [{
+                "time": now,
+                "user": user,
+                "season": season,
+                "episode": episode,
+                "intro_end": intro_end,
+                "credits_start": credits_start,
+                "source": source
+            }]
+            marker["history"] = marker["history"][-HISTORY_LIMIT:]
+            self._plugin.save_data(self._key(series_id), marker)
+        return marker
+
+    def migrate_legacy(self):
+        """
+        旧版本以剧名为key保存，迁移到以剧集ID为key
+        """
+        migrated = 0
+        for key, value in self._all_data():
+            if key.startswith(KEY_PREFIX) or key in RESERVED_KEYS:
+                continue
+            if not isinstance(value, dict) or "intro_end" not in value or not value.get("item_id"):
+                continue
+            if not self.get(value.get("item_id")):
+                self._plugin.save_data(self._key(value.get("item_id")), {
+                    "series_id": str(value.get("item_id")),
+                    "series_name": key,
+                    "intro_end": value.get("intro_end") or 0,
+                    "credits_start": value.get("credits_start") or 0,
+                    "updated": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "history": []
+                })
+            self._plugin.del_data(key)
+            migrated += 1
+        if migrated:
+            logger.info(f"已迁移 {migrated} 个旧版本剧集标记")
+
+    def _all_data(self):
+        """
+        一次查询读取本插件全部数据
+        """
+        for data in self._plugin.get_data() or []:
+            value = data.value
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            yield data.key, value
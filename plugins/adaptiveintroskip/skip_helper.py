@@ -1,4 +1,11 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Set, Tuple
+
 import requests
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
 from app.core.config import settings
 from app.log import logger
 from datetime import datetime
@@ -16,6 +23,26 @@ if not base_url.startswith("http"):
 api_key = settings.EMBY_API_KEY
 headers = {'X-Emby-Token': api_key}
 
+# 章节并发更新线程数
+CHAPTER_WORKERS = 8
+
+# 共享长连接
+session = requests.Session()
+session.headers.update(headers)
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=CHAPTER_WORKERS))
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=CHAPTER_WORKERS))
+
+# 分集列表额外请求的字段，Id、IndexNumber、ParentIndexNumber、RunTimeTicks默认返回
+# Path供指纹分析定位本地文件，顺带在同一次请求中取回
+EPISODE_FIELDS = 'Path'
+
+# 剧集分集列表缓存，key为剧集item_id，新集入库时失效
+episodes_cache = TTLCache(maxsize=128, ttl=300)
+episodes_cache_lock = threading.Lock()
+
+# 剧集的TMDB ID缓存，key为剧集item_id
+series_tmdb_cache = TTLCache(maxsize=256, ttl=86400)
+
 
 def format_time(seconds):
     # 将秒数转换为 datetime.timedelta 对象
@@ -25,13 +52,40 @@ def format_time(seconds):
     return formatted_time
 
 
+def get_episodes(item_id) -> list:
+    """
+    获取剧集的所有分集信息，同一剧集短时间内只请求一次
+    """
+    key = str(item_id)
+    with episodes_cache_lock:
+        episodes = episodes_cache.get(key)
+    if episodes is not None:
+        return episodes
+    # 分集的Id、季集号、时长都从这一次请求中获取
+    response = session.get(f'{base_url}Shows/{item_id}/Episodes',
+                           params={'Fields': EPISODE_FIELDS})
+    episodes = response.json()['Items']
+    with episodes_cache_lock:
+        episodes_cache[key] = episodes
+    return episodes
+
+
+def invalidate_episodes(item_id=None):
+    """
+    清除剧集分集缓存，不指定item_id则全部清除
+    """
+    with episodes_cache_lock:
+        if item_id is None:
+            episodes_cache.clear()
+        else:
+            episodes_cache.pop(str(item_id), None)
+
+
 def get_next_episode_ids(item_id, season_id, episode_id) -> list:
     try:
         ids = []
-        response = requests.get(f'{base_url}Shows/{item_id}/Episodes', headers=headers)
-        episodes_info = response.json()
         # 查找下一集的 ID
-        for idx, episode in enumerate(episodes_info['Items']):
+        for idx, episode in enumerate(get_episodes(item_id)):
             if episode['IndexNumber'] >= episode_id and season_id == episode['ParentIndexNumber']:
                 next_episode_item_id = episode['Id']
                 logger.debug(f'第{episode_id + idx}集的 item_ID 为: {next_episode_item_id}')
@@ -41,68 +95,156 @@ def get_next_episode_ids(item_id, season_id, episode_id) -> list:
         logger.error("异常错误：%s" % str(e))
 
 
-def get_current_video_item_id(item_id, season_id, episode_id):
+def get_current_episode(item_id, season_id, episode_id) -> dict:
     try:
-        response = requests.get(f'{base_url}Shows/{item_id}/Episodes', headers=headers)
-        episodes_info = response.json()
-        # 查找当前集的 ID
-        for episode in episodes_info['Items']:
-            if episode['IndexNumber'] == episode_id and episode['ParentIndexNumber'] == season_id:
-                item_id = episode['Id']
-                logger.debug(f'第{episode_id}集的 item_ID 为: {item_id}')
-                return item_id
-        return -1
+        # 查找当前集，缓存中没有时可能是新入库的集，清除缓存重新获取一次
+        for refresh in (False, True):
+            if refresh:
+                invalidate_episodes(item_id)
+            for episode in get_episodes(item_id):
+                if episode['IndexNumber'] == episode_id and episode['ParentIndexNumber'] == season_id:
+                    logger.debug(f'第{episode_id}集的 item_ID 为: {episode["Id"]}')
+                    return episode
+        return {}
     except Exception as e:
         logger.error("异常错误：%s" % str(e))
+        return {}
+
+
+def get_episode_runtime(episode: dict):
+    """
+    分集时长（秒），分集列表中没有时长时再请求PlaybackInfo
+    """
+    run_time_ticks = episode.get('RunTimeTicks')
+    if run_time_ticks:
+        return run_time_ticks / 10000000
+    if not episode.get('Id'):
+        return 0
+    return get_total_time(episode['Id'])
+
 
+def get_chapters(item_id) -> list:
+    return session.get(f"{base_url}emby/chapter_api/get_chapters?id={item_id}").json()['chapters']
 
-def update_intro(item_id, intro_end):
+
+# 标记类型 => ChapterAPI 添加参数 (name, type)
+MARKER_ADD_ARGS = {
+    'IntroStart': ('%E7%89%87%E5%A4%B4', 'intro_start'),
+    'IntroEnd': ('%E7%89%87%E5%A4%B4%E7%BB%93%E6%9D%9F', 'intro_end'),
+    'CreditsStart': ('%E7%89%87%E5%B0%BE', 'credits_start'),
+}
+
+
+def chapter_seconds(chapter: dict):
+    """
+    章节位置（秒），兼容 StartPositionTicks 与 时:分:秒.毫秒 两种返回
+    """
+    if chapter.get('StartPositionTicks') is not None:
+        return chapter['StartPositionTicks'] / 10000000
+    time_str = chapter.get('StartTime') or chapter.get('Time')
+    if not time_str:
+        return None
+    hour, minute, sec = str(time_str).split(':')
+    return int(hour) * 3600 + int(minute) * 60 + float(sec)
+
+
+def diff_markers(chapters: list, targets: dict) -> Tuple[list, list, dict]:
+    """
+    对比现有标记与目标位置
+    :return: 需要删除的章节Index，需要添加的标记类型，各类标记的数量
+    """
+    # Intro / Credits
+    groups = {marker_type.replace('Start', '').replace('End', '') for marker_type in targets}
+    existing = [chapter for chapter in chapters if
+                any(chapter.get('MarkerType', '').startswith(group) for group in groups)]
+    add_types = []
+    counts = {"unchanged": 0, "updated": 0, "added": 0}
+    matched = set()
+    for marker_type, target in targets.items():
+        same_type = [chapter for chapter in existing if chapter.get('MarkerType') == marker_type]
+        keep = next((chapter for chapter in same_type
+                     if chapter_seconds(chapter) is not None and abs(chapter_seconds(chapter) - target) < 0.5), None)
+        if keep:
+            matched.add(keep['Index'])
+            counts["unchanged"] += 1
+            continue
+        add_types.append(marker_type)
+        counts["updated" if same_type else "added"] += 1
+    # 同组内未命中目标的旧标记全部删除
+    remove_tags = [chapter['Index'] for chapter in existing if chapter['Index'] not in matched]
+    return remove_tags, add_types, counts
+
+
+def update_chapters(item_id, intro_end=None, credits_start=None, intro_start=None) -> Optional[dict]:
+    """
+    更新单集的片头、片尾标记，片头片尾共用一次章节读取，标记已在目标位置时不写入
+    :param intro_start: 片头开始位置，有冷开场时不为0，默认0
+    :return: 各类标记的数量，失败返回None
+    """
     try:
-        # 每次先移除旧的introskip
-        chapter_info = requests.get(f"{base_url}emby/chapter_api/get_chapters?id={item_id}",
-                                    headers=headers).json()
-        old_tags = [chapter['Index'] for chapter in chapter_info['chapters'] if
-                    chapter['MarkerType'].startswith('Intro')]
+        targets = {}
+        if intro_end is not None:
+            targets['IntroStart'] = intro_start or 0
+            targets['IntroEnd'] = intro_end
+        if credits_start is not None:
+            targets['CreditsStart'] = credits_start
+        remove_tags, add_types, counts = diff_markers(get_chapters(item_id), targets)
         # 删除旧的
-        requests.get(
-            f"{base_url}emby/chapter_api/update_chapters?id={item_id}&index_list={','.join(map(str, old_tags))}&action=remove",
-            headers=headers)
-        # 添加新的片头开始
-        requests.get(
-            f"{base_url}emby/chapter_api/update_chapters?id={item_id}&action=add&name=%E7%89%87%E5%A4%B4&type=intro_start&time=00:00:00.000",
-            headers=headers)
-        # 新的片头结束
-        requests.get(
-            f"{base_url}emby/chapter_api/update_chapters?id={item_id}&action=add&name=%E7%89%87%E5%A4%B4%E7%BB%93%E6%9D%9F&type=intro_end&time={format_time(intro_end)}",
-            headers=headers)
-        return intro_end
+        if remove_tags:
+            session.get(
+                f"{base_url}emby/chapter_api/update_chapters?id={item_id}&index_list={','.join(map(str, remove_tags))}&action=remove")
+        # 添加新的
+        for marker_type in add_types:
+            name, add_type = MARKER_ADD_ARGS[marker_type]
+            session.get(
+                f"{base_url}emby/chapter_api/update_chapters?id={item_id}&action=add&name={name}&type={add_type}&time={format_time(targets[marker_type])}")
+        return counts
     except Exception as e:
         logger.error("异常错误：%s" % str(e))
+        return None
 
 
-def update_credits(item_id, credits_start):
+def batch_update_chapters(item_ids: list, intro_end=None, credits_start=None) -> dict:
+    """
+    并发更新多集的片头、片尾标记，返回各类标记的汇总数量
+    """
+    total = {"unchanged": 0, "updated": 0, "added": 0, "failed": 0}
+    if not item_ids or (intro_end is None and credits_start is None):
+        return total
+    with ThreadPoolExecutor(max_workers=min(CHAPTER_WORKERS, len(item_ids))) as executor:
+        for counts in executor.map(lambda item_id: update_chapters(item_id, intro_end, credits_start), item_ids):
+            if counts is None:
+                total["failed"] += 1
+                continue
+            for key, value in counts.items():
+                total[key] += value
+    logger.info(f"章节标记 未变化:{total['unchanged']} 更新:{total['updated']} 新增:{total['added']} "
+                f"失败集数:{total['failed']}")
+    return total
+
+
+def get_series_tmdb_id(series_id) -> Optional[str]:
+    """
+    剧集（而非单集）的TMDB ID，取自Emby剧集条目的ProviderIds，获取失败返回None
+    """
+    key = str(series_id)
+    if key in series_tmdb_cache:
+        return series_tmdb_cache[key]
     try:
-        chapter_info = requests.get(f"{base_url}emby/chapter_api/get_chapters?id={item_id}",
-                                    headers=headers).json()
-        old_tags = [chapter['Index'] for chapter in chapter_info['chapters'] if
-                    chapter['MarkerType'].startswith('Credits')]
-        # 删除旧的
-        requests.get(
-            f"{base_url}emby/chapter_api/update_chapters?id={item_id}&index_list={','.join(map(str, old_tags))}&action=remove",
-            headers=headers)
-
-        # 添加新的片尾开始
-        requests.get(
-            f"{base_url}emby/chapter_api/update_chapters?id={item_id}&action=add&name=%E7%89%87%E5%B0%BE&type=credits_start&time={format_time(credits_start)}",
-            headers=headers)
-        return credits_start
+        response = session.get(f'{base_url}emby/Items', params={'Ids': series_id, 'Fields': 'ProviderIds'})
+        items = response.json().get('Items') or []
+        provider_ids = items[0].get('ProviderIds') or {} if items else {}
+        tmdb_id = next((value for name, value in provider_ids.items() if name.lower() == 'tmdb'), None) or None
+        series_tmdb_cache[key] = tmdb_id
+        return tmdb_id
     except Exception as e:
-        logger.error("异常错误：%s" % str(e))
+        logger.error("获取剧集TMDB ID异常：%s" % str(e))
+        return None
 
 
 def get_total_time(item_id):
     try:
-        response = requests.get(f'{base_url}emby/Items/{item_id}/PlaybackInfo?api_key={api_key}')
+        response = session.get(f'{base_url}emby/Items/{item_id}/PlaybackInfo')
         video_info = response.json()
         if video_info['MediaSources']:
             video_info = video_info['MediaSources'][0]
@@ -118,27 +260,58 @@ def get_total_time(item_id):
         return 0
 
 
-def include_keyword(path: str, keywords: str) -> dict:
-    keyword_list: list = keywords.split(',')
-    flag = False
-    msg = ""
-    for keyword in keyword_list:
-        if keyword in path:
-            flag = True
-            msg = keyword
-            break
-    if flag:
-        return {'ret': True, 'msg': msg}
-    else:
-        return {'ret': False, 'msg': ''}
-
-
-def exclude_keyword(path: str, keywords: str) -> dict:
-    keyword_list: list = keywords.split(',') if keywords else []
-    for keyword in keyword_list:
-        if keyword in path:
-            return {'ret': False, 'msg': keyword}
-    return {'ret': True, 'msg': ''}
+class KeywordMatcher:
+    """
+    Aho-Corasick 多关键词匹配，扫描一遍文本即可找出出现的全部关键词
+    """
+
+    def __init__(self, keywords: List[str]):
+        self.keywords = keywords
+        # 状态转移、失败指针、各状态命中的关键词序号
+        self._goto: List[dict] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+        for idx, word in enumerate(keywords):
+            if not word:
+                continue
+            node = 0
+            for char in word:
+                nxt = self._goto[node].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[node][char] = nxt
+                node = nxt
+            self._out[node].append(idx)
+        nodes = deque(self._goto[0].values())
+        while nodes:
+            node = nodes.popleft()
+            for char, nxt in self._goto[node].items():
+                nodes.append(nxt)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def __bool__(self):
+        return len(self._goto) > 1
+
+    def search(self, text: str) -> Set[int]:
+        """
+        返回文本中出现的关键词序号
+        """
+        found = set()
+        node = 0
+        for char in text or '':
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            if self._out[node]:
+                found.update(self._out[node])
+        return found
 
 
 if __name__ == '__main__':
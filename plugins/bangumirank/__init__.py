@@ -1,7 +1,9 @@
 import datetime
+import time
 import xml.dom.minidom
+from concurrent.futures import ThreadPoolExecutor
 from threading import Event
-from typing import Tuple, List, Dict, Any
+from typing import Tuple, List, Dict, Any, Optional
 
 import pytz
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -28,7 +30,7 @@ class BangumiRank(_PluginBase):
     # 插件图标
     plugin_icon = "https://raw.githubusercontent.com/honue/MoviePilot-Plugins/main/icons/miku.jpg"
     # 插件版本
-    plugin_version = "1.4"
+    plugin_version = "1.7"
     # 插件作者
     plugin_author = "honue"
     # 作者主页
@@ -57,6 +59,14 @@ class BangumiRank(_PluginBase):
     _uid = None
     _wish_top = None
 
+    # 订阅历史最多保留条数，更早的只保留在去重索引中
+    HISTORY_LIMIT = 300
+    # 识别媒体与存在性检查的并发数
+    CHECK_WORKERS = 8
+    # 未识别、已存在的标题跳过时长，每次失败翻倍，最长30天
+    NEGATIVE_TTL = 6 * 3600
+    NEGATIVE_MAX_TTL = 30 * 24 * 3600
+
     def init_plugin(self, config: dict = None):
         self.downloadchain = DownloadChain()
         self.subscribechain = SubscribeChain()
@@ -509,90 +519,168 @@ class BangumiRank(_PluginBase):
             logger.info(f"未设置相关参数，运行结束")
             return
 
-        # 读取历史记录
+        # 读取历史记录与去重索引
         if self._clearflag:
             history = []
+            unique_index = set()
+            negative: Dict[str, dict] = {}
         else:
             history: List[dict] = self.get_data('history') or []
+            unique_index = self.__load_unique_index(history)
+            negative: Dict[str, dict] = self.get_data('negative') or {}
 
         logger.info(f"开始刷新Bangumi榜单 ...")
+        rss_infos = []
         for addr in addr_list:
             if not addr:
                 continue
+            logger.info(f"获取RSS：{addr} ...")
+            addr_infos = self.__get_rss_info(addr)
+            if not addr_infos:
+                logger.error(f"RSS地址：{addr} ，未查询到数据")
+                continue
+            logger.info(f"RSS地址：{addr} ，获取 {len(addr_infos)} 条数据")
+            rss_infos.extend(addr_infos)
+
+        # 过滤已处理过的条目，想看和榜单中重复的条目只处理一次
+        todo = {}
+        for rss_info in rss_infos:
+            title = rss_info.get('title')
+            unique_flag = f"bangumirank: {title} (DB:{rss_info.get('link')})"
+            # 检查是否已处理过
+            if unique_flag in unique_index:
+                logger.info(f"{title} 已处理过")
+                continue
+            # 之前未识别或已存在，退避期内不再检查
+            skip = negative.get(title)
+            if skip and skip.get("until", 0) > time.time():
+                until = datetime.datetime.fromtimestamp(skip["until"]).strftime("%Y-%m-%d %H:%M")
+                logger.info(f"{title} {skip.get('reason')}，{until} 前跳过")
+                continue
+            todo.setdefault(unique_flag, rss_info)
+
+        # 识别媒体与存在性检查并行执行，添加订阅串行执行
+        with ThreadPoolExecutor(max_workers=self.CHECK_WORKERS, thread_name_prefix="BangumiRank") as executor:
+            checked = list(executor.map(self.__check_item, todo.values()))
+
+        subscribed = set()
+        for unique_flag, rss_info, (meta, mediainfo, reason) in zip(todo.keys(), todo.values(), checked):
+            if self._event.is_set():
+                logger.info(f"订阅服务停止")
+                break
+            title = rss_info.get('title')
+            if reason:
+                self.__add_negative(negative, title, reason)
+                continue
+            if not mediainfo:
+                continue
+            negative.pop(title, None)
+            bangumi_link = rss_info.get('link')
+            # 不同标题识别为同一媒体时只订阅一次
+            media_key = (mediainfo.tmdb_id, meta.begin_season)
+            if media_key in subscribed:
+                logger.info(f'{mediainfo.title_year} 本次已添加订阅')
+                continue
             try:
-                logger.info(f"获取RSS：{addr} ...")
-                rss_infos = self.__get_rss_info(addr)
-                if not rss_infos:
-                    logger.error(f"RSS地址：{addr} ，未查询到数据")
+                # 添加订阅
+                sid, msg = self.subscribechain.add(title=mediainfo.title,
+                                                   year=mediainfo.year,
+                                                   mtype=mediainfo.type,
+                                                   tmdbid=mediainfo.tmdb_id,
+                                                   season=meta.begin_season,
+                                                   exist_ok=True,
+                                                   username="Bangumi榜单")
+                subscribed.add(media_key)
+                db = get_db()
+                subscribe: Subscribe = Subscribe.get(db, sid)
+                if not subscribe:
+                    # 跳过本条，其余条目和历史记录照常处理
+                    logger.error(f"{title} 订阅不存在，设置过滤关键词失败")
                     continue
-                else:
-                    logger.info(f"RSS地址：{addr} ，获取 {len(rss_infos)} 条数据")
-                for rss_info in rss_infos:
-                    if self._event.is_set():
-                        logger.info(f"订阅服务停止")
-                        return
-
-                    title = rss_info.get('title')
-                    bangumi_link = rss_info.get('link')
-                    unique_flag = f"bangumirank: {title} (DB:{bangumi_link})"
-                    # 检查是否已处理过
-                    if unique_flag in [h.get("unique") for h in history]:
-                        logger.info(f"{title} 已处理过")
-                        continue
-                    # 元数据
-                    meta = MetaInfo(title)
-                    mediainfo: MediaInfo = self.chain.recognize_media(meta=meta)
-                    if not mediainfo:
-                        logger.warn(f'未识别到媒体信息，标题：{title}，link：{bangumi_link}')
-                        continue
-
-                    # 查询缺失的媒体信息
-                    exist_flag, _ = self.downloadchain.get_no_exists_info(meta=meta, mediainfo=mediainfo)
-                    if exist_flag:
-                        logger.info(f'{mediainfo.title_year} 媒体库中已存在')
-                        continue
-                    # 判断用户是否已经添加订阅
-                    if self.subscribechain.exists(mediainfo=mediainfo, meta=meta):
-                        logger.info(f'{mediainfo.title_year} 订阅已存在')
-                        continue
-                    # 添加订阅
-                    sid, msg = self.subscribechain.add(title=mediainfo.title,
-                                                       year=mediainfo.year,
-                                                       mtype=mediainfo.type,
-                                                       tmdbid=mediainfo.tmdb_id,
-                                                       season=meta.begin_season,
-                                                       exist_ok=True,
-                                                       username="Bangumi榜单")
-                    db = get_db()
-                    subscribe: Subscribe = Subscribe.get(db, sid)
-                    if not subscribe:
-                        logger.error("订阅不存在，设置过滤关键词失败")
-                        return
-                    subscribe.include = self._include
-                    subscribe.exclude = self._exclude
-                    subscribe.update(db=db, payload=subscribe.to_dict())
-
-                    # 存储历史记录
-                    history.append({
-                        "title": title,
-                        "type": mediainfo.type.value,
-                        "year": mediainfo.year,
-                        "poster": mediainfo.get_poster_image(),
-                        "overview": mediainfo.overview,
-                        "tmdbid": mediainfo.tmdb_id,
-                        "bangumi_link": bangumi_link,
-                        "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "unique": unique_flag
-                    })
+                subscribe.include = self._include
+                subscribe.exclude = self._exclude
+                subscribe.update(db=db, payload=subscribe.to_dict())
             except Exception as e:
-                logger.error(str(e))
+                logger.error(f"{title} 添加订阅失败：{str(e)}")
+                continue
+
+            # 存储历史记录
+            history.append({
+                "title": title,
+                "type": mediainfo.type.value,
+                "year": mediainfo.year,
+                "poster": mediainfo.get_poster_image(),
+                "overview": mediainfo.overview,
+                "tmdbid": mediainfo.tmdb_id,
+                "bangumi_link": bangumi_link,
+                "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "unique": unique_flag
+            })
+            unique_index.add(unique_flag)
 
         # 保存历史记录
-        self.save_data('history', history)
+        self.save_data('history', history[-self.HISTORY_LIMIT:])
+        self.save_data('unique_index', list(unique_index))
+        self.save_data('negative', self.__prune_negative(negative))
         # 缓存只清理一次
         self._clearflag = False
         logger.info(f"所有榜单RSS刷新完成")
 
+    def __check_item(self, rss_info: dict) -> Tuple[Optional[MetaInfo], Optional[MediaInfo], Optional[str]]:
+        """
+        识别媒体并检查媒体库、订阅是否已存在，在线程池中执行
+        :return: (meta, mediainfo, 跳过原因)，需要订阅时跳过原因为None，出错时均为None
+        """
+        if self._event.is_set():
+            return None, None, None
+        title = rss_info.get('title')
+        try:
+            # 元数据
+            meta = MetaInfo(title)
+            mediainfo: MediaInfo = self.chain.recognize_media(meta=meta)
+            if not mediainfo:
+                logger.warn(f'未识别到媒体信息，标题：{title}，link：{rss_info.get("link")}')
+                return meta, None, "未识别到媒体信息"
+
+            # 查询缺失的媒体信息
+            exist_flag, _ = self.downloadchain.get_no_exists_info(meta=meta, mediainfo=mediainfo)
+            if exist_flag:
+                logger.info(f'{mediainfo.title_year} 媒体库中已存在')
+                return meta, mediainfo, "媒体库中已存在"
+            # 判断用户是否已经添加订阅
+            if self.subscribechain.exists(mediainfo=mediainfo, meta=meta):
+                logger.info(f'{mediainfo.title_year} 订阅已存在')
+                return meta, mediainfo, "订阅已存在"
+            return meta, mediainfo, None
+        except Exception as e:
+            logger.error(f"{title} 处理失败：{str(e)}")
+            return None, None, None
+
+    def __add_negative(self, negative: Dict[str, dict], title: str, reason: str):
+        """
+        记录跳过的标题，连续跳过时退避时间翻倍
+        """
+        failures = (negative.get(title) or {}).get("failures", 0) + 1
+        ttl = min(self.NEGATIVE_TTL * 2 ** (failures - 1), self.NEGATIVE_MAX_TTL)
+        negative[title] = {"reason": reason, "failures": failures, "until": int(time.time() + ttl)}
+
+    def __prune_negative(self, negative: Dict[str, dict]) -> Dict[str, dict]:
+        """
+        过期超过最长退避时间的记录不再影响退避，删除
+        """
+        now = time.time()
+        return {title: item for title, item in negative.items()
+                if item.get("until", 0) + self.NEGATIVE_MAX_TTL > now}
+
+    def __load_unique_index(self, history: List[dict]) -> set:
+        """
+        已处理条目的unique集合，旧版本没有索引时从历史记录生成
+        """
+        unique_index = self.get_data('unique_index')
+        if unique_index is None:
+            unique_index = [h.get("unique") for h in history if h.get("unique")]
+        return set(unique_index)
+
     def __get_rss_info(self, addr) -> List[dict]:
         """
         获取RSS
@@ -6,11 +6,39 @@ from app.log import logger
 from app.plugins import _PluginBase
 from app.schemas import WebhookEventInfo, MediaInfo
 from app.schemas.types import EventType, MediaType
-from app.utils.http import RequestUtils
 from cachetools import cached, TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import requests
 import re
 import datetime
+import threading
+import time
+
+
+class TimeoutSession(requests.Session):
+    """
+    带默认超时、连接池与重试的Session，每个上游服务一个
+    """
+
+    def __init__(self, timeout=(5, 20), headers: dict = None, proxies: dict = None):
+        super().__init__()
+        self.timeout = timeout
+        # bgm的写操作都是设置状态，重试是幂等的
+        retry = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=["GET", "POST", "PUT", "PATCH"], respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=retry)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        if headers:
+            self.headers.update(headers)
+        if proxies:
+            self.proxies.update(proxies)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
 
 class BangumiSync(_PluginBase):
     # 插件名称
@@ -20,7 +48,7 @@ class BangumiSync(_PluginBase):
     # 插件图标
     plugin_icon = "https://raw.githubusercontent.com/honue/MoviePilot-Plugins/main/icons/bangumi.jpg"
     # 插件版本
-    plugin_version = "1.8.1"
+    plugin_version = "1.9.2"
     # 插件作者
     plugin_author = "honue,happyTonakai"
     # 作者主页
@@ -40,23 +68,77 @@ class BangumiSync(_PluginBase):
     _token = None
     _tmdb_key = None
     _request = None
+    _tmdb_request = None
+    _media_request = None
+    _mapping = ""
+    _overrides = {}
+    _backfill = False
+
+    # 标题+季 => subject_id 映射缓存有效期
+    SUBJECT_TTL = 30 * 24 * 3600
+    # subject_id => episodes 缓存有效期，找不到对应集时会强制刷新
+    EPISODES_TTL = 7 * 24 * 3600
+    # 剧集列表分页大小
+    EPISODES_PAGE_SIZE = 200
+    # 同一番剧的播放事件等待合并的时间（秒）
+    COALESCE_DELAY = 10
+    # 历史导入每个番剧之间的间隔（秒），避免触发bgm api限流
+    BACKFILL_INTERVAL = 2
+
+    # 待同步 标题|季 => {"title", "season", "episodes", "due"}
+    _pending: Dict[str, dict] = {}
+    _pending_cond: threading.Condition = None
+    _worker: threading.Thread = None
+    # 每次启动的后台线程各自的停止信号，停止超时仍在运行的旧线程不会被新的启动复位
+    _worker_stop: threading.Event = None
+    # 已同步的 (subject_id, episode)，避免开始播放、播放完成重复同步
+    _synced: TTLCache = None
+    # subject_id => 剧集索引
+    _episode_index: TTLCache = None
+    # 后台队列与历史导入共用，保证同一时间只有一个同步
+    _sync_lock = threading.Lock()
+    _backfill_thread: threading.Thread = None
+    _backfill_stop: threading.Event = None
 
     def init_plugin(self, config: dict = None):
+        # 停止现有任务
+        self.stop_service()
+
         if config:
             self._enable = config.get('enable')
             self._user = config.get('user') if config.get('user') else None
             self._token = config.get('token') if config.get('token') else None
+            self._mapping = config.get('mapping') or ""
+            self._backfill = config.get('backfill') or False
+            self._overrides = self.__parse_mapping(self._mapping)
             self._tmdb_key = settings.TMDB_API_KEY
             headers = {"Authorization": f"Bearer {self._token}",
                     "User-Agent": BangumiSync.UA,
                     "content-type": "application/json"}
-            self._request = requests.Session()
-            self._request.headers.update(headers)
-            if settings.PROXY:
-                self._request.proxies.update(settings.PROXY)
+            self._request = TimeoutSession(headers=headers, proxies=settings.PROXY)
             self.__update_config()
             logger.debug("Bangumi在看同步插件初始化成功")
 
+        # tmdb走代理，媒体服务器一般在内网不走代理
+        self._tmdb_request = TimeoutSession(headers={"User-Agent": BangumiSync.UA}, proxies=settings.PROXY)
+        self._media_request = TimeoutSession()
+
+        # 后台同步队列
+        self._pending = {}
+        self._pending_cond = threading.Condition()
+        self._synced = TTLCache(maxsize=100, ttl=600)
+        self._episode_index = TTLCache(maxsize=100, ttl=3600)
+        self._worker_stop = threading.Event()
+        self._worker = threading.Thread(target=self.__run_queue, args=(self._pending_cond, self._worker_stop),
+                                        name="BangumiSync", daemon=True)
+        self._worker.start()
+
+        # 导入历史观看记录，开关只生效一次，未完成的进度下次继续
+        if self._enable and self._backfill:
+            self._backfill = False
+            self.__update_config()
+            self.start_backfill()
+
     @eventmanager.register(EventType.WebhookMessage)
     def hook(self, event: Event):
         # 插件未启用
@@ -91,19 +173,221 @@ class BangumiSync(_PluginBase):
 
             # 季 集
             season_id, episode_id = map(int, [event_info.season_id, event_info.episode_id])
-            self._prefix = f"{title} 第{season_id}季 第{episode_id}集"
-            # 使用 tmdb airdate 来定位季，提高准确率
-            subject_name, subject_id = self.get_subjectid_by_title(title, season_id)
-            if subject_id is None:
-                return
-            logger.info(f"{self._prefix}: {title} => {subject_name} https://bgm.tv/subject/{subject_id}")
+            self.__enqueue(title, season_id, episode_id)
+
+    def __enqueue(self, title: str, season: int, episode: int):
+        """
+        加入后台同步队列，同一番剧短时间内的多个事件合并为一次同步
+        """
+        key = f"{title}|{season}"
+        with self._pending_cond:
+            job = self._pending.get(key)
+            if job:
+                job["episodes"].add(episode)
+                logger.info(f"{title} 第{season}季 第{episode}集: 合并到待同步队列")
+            else:
+                self._pending[key] = {"title": title, "season": season, "episodes": {episode},
+                                      "due": time.time() + BangumiSync.COALESCE_DELAY}
+            self._pending_cond.notify()
 
+    def __run_queue(self, cond: threading.Condition, stop: threading.Event):
+        """
+        后台同步线程
+        """
+        while True:
+            with cond:
+                due_keys = []
+                while not stop.is_set():
+                    now = time.time()
+                    due_keys = [key for key, job in self._pending.items() if job["due"] <= now]
+                    if due_keys:
+                        break
+                    next_due = min((job["due"] for job in self._pending.values()), default=now + 60)
+                    cond.wait(max(0.1, next_due - now))
+                if stop.is_set():
+                    return
+                jobs = [self._pending.pop(key) for key in due_keys]
+            for job in jobs:
+                self.__sync(job)
+
+    def __sync(self, job: dict) -> bool:
+        """
+        同步一个番剧季，返回是否成功
+        """
+        title, season_id = job["title"], job["season"]
+        episodes = sorted(job["episodes"])
+        with self._sync_lock:
+            self._prefix = f"{title} 第{season_id}季 第{','.join(map(str, episodes))}集"
             try:
-                self.sync_watching_status(subject_id, episode_id)
+                # 使用 tmdb airdate 来定位季，提高准确率
+                subject_name, subject_id = self.get_subject(title, season_id)
+                if subject_id is None:
+                    return False
+                logger.info(f"{self._prefix}: {title} => {subject_name} https://bgm.tv/subject/{subject_id}")
+                return self.sync_watching_status(subject_id, episodes)
             except Exception as e:
                 logger.warning(f"{self._prefix}: 同步在看状态失败: {e}")
+                return False
+
+    def start_backfill(self) -> bool:
+        """
+        后台导入媒体服务器的历史观看记录
+        """
+        if not self._user:
+            logger.warning("未设置媒体服务器用户名，无法导入历史记录")
+            return False
+        if self._backfill_thread and self._backfill_thread.is_alive():
+            logger.info("Bangumi历史记录导入正在进行中")
+            return False
+        self._backfill_stop = threading.Event()
+        self._backfill_thread = threading.Thread(target=self.__backfill, args=(self._backfill_stop,),
+                                                 name="BangumiSync-backfill", daemon=True)
+        self._backfill_thread.start()
+        return True
+
+    def __backfill(self, stop: threading.Event):
+        """
+        读取媒体服务器已播放的番剧，每个番剧的每一季同步到看过的最后一集
+        进度保存在插件数据中，中断后再次执行会跳过已完成的番剧
+        """
+        progress: Dict[str, Any] = self.get_data("backfill") or {}
+        if progress.get("finished"):
+            progress = {}
+        done = set(progress.get("done") or [])
+        # 标题|季 => 看过的最大集数
+        watched: Dict[str, int] = {}
+        if not self._user:
+            logger.warning("未设置媒体服务器用户名，无法导入历史记录")
+            return
+        for user in self._user.split(','):
+            for item in self.get_played_episodes(user):
+                if item.get("ParentIndexNumber") is None or item.get("IndexNumber") is None:
+                    continue
+                if not BangumiSync.is_anime(item.get("Path") or ""):
+                    continue
+                key = f"{item.get('SeriesName')}|{item.get('ParentIndexNumber')}"
+                watched[key] = max(watched.get(key, 0), item.get("IndexNumber"))
+        todo = [key for key in watched if key not in done]
+        logger.info(f"Bangumi历史记录导入：共{len(watched)}个番剧季，已完成{len(watched) - len(todo)}个")
+        failed = 0
+        for idx, key in enumerate(todo):
+            if stop.is_set():
+                logger.info("Bangumi历史记录导入中断，下次继续")
+                return
+            title, season = key.rsplit("|", 1)
+            if self.__sync({"title": title, "season": int(season), "episodes": {watched[key]}}):
+                done.add(key)
+                self.save_data("backfill", {"done": list(done), "total": len(watched), "failed": failed,
+                                            "finished": False,
+                                            "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+                logger.info(f"Bangumi历史记录导入进度 {idx + 1}/{len(todo)}：{title} 第{season}季 第{watched[key]}集")
+            else:
+                # 失败的番剧不记为完成，下次导入时重试
+                failed += 1
+                logger.warning(f"Bangumi历史记录导入进度 {idx + 1}/{len(todo)}：{title} 第{season}季 同步失败")
+            time.sleep(BangumiSync.BACKFILL_INTERVAL)
+        # 有失败的番剧时保留进度，再次导入只重试失败的
+        self.save_data("backfill", {"done": list(done), "total": len(watched), "failed": failed,
+                                    "finished": not failed,
+                                    "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+        if failed:
+            logger.info(f"Bangumi历史记录导入结束，{failed}个番剧季同步失败，再次导入时重试")
+        else:
+            logger.info("Bangumi历史记录导入完成")
+
+    @staticmethod
+    def __media_server() -> Tuple:
+        """
+        (地址, api_key)，优先Emby
+        """
+        for host, api_key, prefix in [(getattr(settings, "EMBY_HOST", None), getattr(settings, "EMBY_API_KEY", None),
+                                       "emby/"),
+                                      (getattr(settings, "JELLYFIN_HOST", None),
+                                       getattr(settings, "JELLYFIN_API_KEY", None), "")]:
+            if host and api_key:
+                host = host if host.startswith("http") else f"http://{host}"
+                return f"{host.rstrip('/')}/{prefix}", api_key
+        return None, None
+
+    def get_played_episodes(self, user_name: str) -> List[dict]:
+        """
+        媒体服务器中用户已播放的剧集
+        """
+        host, api_key = self.__media_server()
+        if not host:
+            logger.warning("未配置Emby/Jellyfin，无法导入历史记录")
+            return []
+        try:
+            users = self._media_request.get(f"{host}Users", params={"api_key": api_key})
+        except requests.RequestException as e:
+            logger.warning(f"连接媒体服务器失败：{str(e)}")
+            return []
+        user_id = next((user.get("Id") for user in (users.json() if users.ok else []) if user.get("Name") == user_name),
+                       None)
+        if not user_id:
+            logger.warning(f"媒体服务器中未找到用户 {user_name}")
+            return []
+        items = []
+        start = 0
+        while True:
+            try:
+                res = self._media_request.get(f"{host}Users/{user_id}/Items", params={
+                    "api_key": api_key,
+                    "Recursive": "true",
+                    "IncludeItemTypes": "Episode",
+                    "IsPlayed": "true",
+                    "Fields": "Path",
+                    "StartIndex": start,
+                    "Limit": 500
+                })
+            except requests.RequestException as e:
+                logger.warning(f"获取媒体服务器播放记录失败：{str(e)}")
+                break
+            if not res.ok:
+                logger.warning(f"获取媒体服务器播放记录失败, code={res.status_code}")
+                break
+            page = res.json().get("Items") or []
+            items += page
+            start += len(page)
+            if len(page) < 500:
+                break
+        return items
+
+    @staticmethod
+    def __parse_mapping(mapping: str) -> Dict[str, int]:
+        """
+        手动映射，每行 标题#季#subject_id
+        """
+        overrides = {}
+        for line in mapping.split("\n"):
+            parts = line.strip().split("#")
+            if len(parts) != 3 or not parts[1].isdigit() or not parts[2].isdigit():
+                if line.strip():
+                    logger.warning(f"Bangumi手动映射格式错误，已忽略：{line}")
+                continue
+            overrides[f"{parts[0]}|{int(parts[1])}"] = int(parts[2])
+        return overrides
+
+    def get_subject(self, title: str, season: int) -> Tuple:
+        """
+        标题+季 => (subject_name, subject_id)，依次查找手动映射、持久化缓存、bgm搜索
+        """
+        key = f"{title}|{season}"
+        if key in self._overrides:
+            subject_id = self._overrides[key]
+            logger.debug(f"{self._prefix}: 使用手动映射 subject id {subject_id}")
+            return title, subject_id
+        mapping: Dict[str, dict] = self.get_data("subject_mapping") or {}
+        cached_subject = mapping.get(key)
+        if cached_subject and time.time() - cached_subject.get("time", 0) < BangumiSync.SUBJECT_TTL:
+            logger.debug(f"{self._prefix}: 使用缓存 subject id {cached_subject.get('subject_id')}")
+            return cached_subject.get("subject_name"), cached_subject.get("subject_id")
+        subject_name, subject_id = self.get_subjectid_by_title(title, season)
+        if subject_id is not None:
+            mapping[key] = {"subject_name": subject_name, "subject_id": subject_id, "time": int(time.time())}
+            self.save_data("subject_mapping", mapping)
+        return subject_name, subject_id
 
-    @cached(TTLCache(maxsize=100, ttl=3600))
     def get_subjectid_by_title(self, title: str, season: int) -> Tuple:
         logger.debug(f"{self._prefix}: 尝试使用 bgm api 来获取 subject id...")
         tmdb_id, original_name = self.get_tmdb_id(title)
@@ -134,8 +418,8 @@ class BangumiSync(_PluginBase):
     @cached(TTLCache(maxsize=100, ttl=3600))
     def get_tmdb_id(self, title: str):
         logger.debug(f"{self._prefix}: 尝试使用 tmdb api 来获取 subject id...")
-        url = f"https://api.tmdb.org/3/search/tv?query={title}&api_key={self._tmdb_key}"
-        ret = requests.get(url, proxies=settings.PROXY).json()
+        ret = self._tmdb_request.get("https://api.tmdb.org/3/search/tv",
+                                     params={"query": title, "api_key": self._tmdb_key}).json()
         if ret.get("total_results"):
             results = ret.get("results")
         else:
@@ -148,8 +432,8 @@ class BangumiSync(_PluginBase):
     @cached(TTLCache(maxsize=100, ttl=3600))
     def get_airdate(self, tmdbid: int, season: int):
         logger.debug(f"{self._prefix}: 尝试使用 tmdb api 来获取 airdate...")
-        url = f"https://api.tmdb.org/3/tv/{tmdbid}/season/{season}?language=zh-CN&api_key={self._tmdb_key}"
-        resp = requests.get(url, proxies=settings.PROXY).json()
+        resp = self._tmdb_request.get(f"https://api.tmdb.org/3/tv/{tmdbid}/season/{season}",
+                                      params={"language": "zh-CN", "api_key": self._tmdb_key}).json()
         air_date = resp.get("air_date")
         air_date = datetime.datetime.strptime(air_date, "%Y-%m-%d").date()
         # 时差原因可能有偏差，且tmdb不计算第0话的首播时间
@@ -157,8 +441,16 @@ class BangumiSync(_PluginBase):
         end_date = air_date + datetime.timedelta(days=15)
         return start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")
 
-    @cached(TTLCache(maxsize=10, ttl=600))
-    def sync_watching_status(self, subject_id, episode):
+    def sync_watching_status(self, subject_id, episodes: List[int]) -> bool:
+        """
+        点格子并更新收藏状态，返回是否成功
+        """
+        # 十分钟内已同步过的集不再重复同步
+        episodes = [episode for episode in episodes if (subject_id, episode) not in self._synced]
+        if not episodes:
+            logger.info(f"{self._prefix}: 最近已同步，跳过")
+            return True
+
         # 获取uid
         if not self._bgm_uid:
             resp = self._request.get(url="https://api.bgm.tv/v0/me")
@@ -166,39 +458,80 @@ class BangumiSync(_PluginBase):
             logger.debug(f"{self._prefix}: 获取到 bgm_uid {self._bgm_uid}")
         else:
             logger.debug(f"{self._prefix}: 使用 bgm_uid {self._bgm_uid}")
-        
+
         # 更新合集状态
         self.update_collection_status(subject_id)
-        
+
         # 获取episode id
-        ep_info = self.get_episodes_info(subject_id)
+        ep_index = self.get_episode_index(subject_id)
+        if self.find_episode(ep_index, episodes[-1])[0] is None:
+            # 缓存的剧集列表可能还没有新的一集
+            ep_index = self.get_episode_index(subject_id, refresh=True)
+        ep_info = ep_index["episodes"]
 
-        found = False
-        for info in ep_info:
-            if info["sort"] == episode and info["name"]:
-                episode_id = info["id"]
-                found = True
-                break
-        
-        if not found:
-            for info in ep_info:
-                if info["ep"] == episode and info["name"]:
-                    episode_id = info["id"]
-                    found = True
-                    break
-        
-        last_episode = info == ep_info[-1]
-        
-        if not found:
-            logger.warning(f"{self._prefix}: 未找到episode，可能因为TMDB和BGM的episode映射关系不一致")
-            return
+        last_episode = False
+        watched = []
+        for episode in episodes:
+            episode_id, is_last = self.find_episode(ep_index, episode)
+            if episode_id is None:
+                logger.warning(f"{self._prefix}: 未找到第{episode}集episode，可能因为TMDB和BGM的episode映射关系不一致")
+                continue
+            watched.append(episode_id)
+            last_episode = last_episode or is_last
+        if not watched:
+            return False
 
-        # 点格子
-        self.update_episode_status(episode_id)
+        # 点格子，看到的最后一集之前的正片一并标记
+        max_sort = max(info.get("sort") or 0 for info in ep_info if info.get("id") in watched)
+        episode_ids = [info["id"] for info in ep_info
+                       if info.get("type", 0) == 0 and (info.get("sort") or 0) <= max_sort] or watched
+        if not self.update_episodes_status(subject_id, list(dict.fromkeys(episode_ids + watched))):
+            return False
+        for episode in episodes:
+            self._synced[(subject_id, episode)] = True
 
         # 最后一集，更新状态为看过
         if last_episode:
             self.update_collection_status(subject_id, 2)
+        return True
+
+    def get_episode_index(self, subject_id, refresh: bool = False) -> dict:
+        """
+        剧集列表及按 sort、ep 建立的索引，随剧集列表一起缓存
+        """
+        index = None if refresh else self._episode_index.get(subject_id)
+        if index is None:
+            episodes = self.get_episodes(subject_id, refresh=refresh)
+            index = self.build_episode_index(episodes or [])
+            # 获取失败时不缓存，下次重新获取
+            if episodes is not None:
+                self._episode_index[subject_id] = index
+        return index
+
+    @staticmethod
+    def build_episode_index(ep_info: list) -> dict:
+        """
+        {"episodes": 剧集列表, "sort": {sort: info}, "ep": {ep: info}, "last": 最后一集id}
+        同一个sort/ep有多条时取第一条，没有标题的集不参与匹配
+        """
+        index = {"episodes": ep_info, "sort": {}, "ep": {}, "last": ep_info[-1]["id"] if ep_info else None}
+        for info in ep_info:
+            if not info.get("name"):
+                continue
+            for key in ("sort", "ep"):
+                if info.get(key) is not None:
+                    index[key].setdefault(info[key], info)
+        return index
+
+    @staticmethod
+    def find_episode(ep_index: dict, episode: int) -> Tuple:
+        """
+        查找第episode集的 (episode_id, 是否最后一集)，先按sort再按ep匹配
+        """
+        info = ep_index["sort"].get(episode) or ep_index["ep"].get(episode)
+        if not info:
+            return None, False
+        return info["id"], info["id"] == ep_index["last"]
 
     @cached(TTLCache(maxsize=100, ttl=3600))
     def update_collection_status(self, subject_id, new_type=3):
@@ -227,33 +560,96 @@ class BangumiSync(_PluginBase):
             logger.warning(resp.text)
             logger.warning(f"{self._prefix}: 合集状态 {type_dict[old_type]} => {type_dict[new_type]}，在看状态更新失败")
 
-    @cached(TTLCache(maxsize=100, ttl=3600))
-    def get_episodes_info(self, subject_id):
-        resp = self._request.get("https://api.bgm.tv/v0/episodes", params={"subject_id": subject_id})
-        if resp.status_code == 200:
-            logger.debug(f"{self._prefix}: 获取 episode info 成功")
-        else:
-            logger.warning(f"{self._prefix}: 获取 episode info 失败, code={resp.status_code}")
-        ep_info = resp.json()["data"]
+    def get_episodes(self, subject_id, refresh: bool = False) -> list | None:
+        """
+        subject_id => episodes，持久化缓存，获取失败返回None
+        """
+        key = f"episodes:{subject_id}"
+        cached_episodes = None if refresh else self.get_data(key)
+        if cached_episodes and time.time() - cached_episodes.get("time", 0) < BangumiSync.EPISODES_TTL:
+            return cached_episodes.get("data") or []
+        ep_info = self.get_episodes_info(subject_id)
+        if ep_info:
+            self.save_data(key, {"time": int(time.time()), "data": ep_info})
         return ep_info
 
-    @cached(TTLCache(maxsize=100, ttl=3600))
-    def update_episode_status(self, episode_id):
+    def get_episodes_info(self, subject_id) -> list | None:
+        """
+        分页获取条目的全部剧集，任一页失败返回None，避免把不完整的列表当作全部剧集
+        """
+        ep_info = []
+        while True:
+            resp = self._request.get("https://api.bgm.tv/v0/episodes",
+                                     params={"subject_id": subject_id, "offset": len(ep_info),
+                                             "limit": BangumiSync.EPISODES_PAGE_SIZE})
+            if resp.status_code != 200:
+                logger.warning(f"{self._prefix}: 获取 episode info 失败, code={resp.status_code}")
+                return None
+            resp = resp.json()
+            page = resp.get("data") or []
+            ep_info += page
+            if not page or len(ep_info) >= resp.get("total", 0):
+                logger.debug(f"{self._prefix}: 获取 episode info 成功，共{len(ep_info)}集")
+                break
+        return ep_info
+
+    def get_collection_episodes(self, subject_id) -> Dict[int, int] | None:
+        """
+        用户在该条目下各集的收藏状态 episode_id => type，获取失败返回None
+        """
+        states = {}
+        offset = 0
+        while True:
+            resp = self._request.get(f"https://api.bgm.tv/v0/users/-/collections/{subject_id}/episodes",
+                                     params={"offset": offset, "limit": 100})
+            if resp.status_code != 200:
+                logger.warning(f"{self._prefix}: 获取单集收藏状态失败, code={resp.status_code}")
+                return None
+            resp = resp.json()
+            items = resp.get("data") or []
+            for item in items:
+                states[item["episode"]["id"]] = item.get("type", 0)
+            offset += len(items)
+            if not items or offset >= resp.get("total", 0):
+                return states
+
+    def update_episodes_status(self, subject_id, episode_ids: List[int]) -> bool:
+        """
+        对比单集收藏状态后，一次请求批量点格子，返回是否全部点上
+        """
+        states = self.get_collection_episodes(subject_id)
+        if states is None:
+            results = [self.update_episode_status(episode_id) for episode_id in episode_ids]
+            return all(results)
+        todo = [episode_id for episode_id in episode_ids if states.get(episode_id) != 2]
+        if not todo:
+            logger.info(f"{self._prefix}: 单集已经点过格子了")
+            return True
+        resp = self._request.patch(f"https://api.bgm.tv/v0/users/-/collections/{subject_id}/episodes",
+                                   json={"episode_id": todo, "type": 2})
+        if resp.status_code == 204:
+            logger.info(f"{self._prefix}: 批量点格子成功，共{len(todo)}集")
+            return True
+        logger.warning(f"{self._prefix}: 批量点格子失败, code={resp.status_code}")
+        return False
+
+    def update_episode_status(self, episode_id) -> bool:
         url = f"https://api.bgm.tv/v0/users/-/collections/-/episodes/{episode_id}"
         resp = self._request.get(url)
         if resp.status_code == 200:
             resp = resp.json()
             if resp["type"] == 2:
                 logger.info(f"{self._prefix}: 单集已经点过格子了")
-                return
+                return True
         else:
             logger.warning(f"{self._prefix}: 获取单集信息失败, code={resp.status_code}")
-            return
+            return False
         resp = self._request.put(url, json={"type": 2})
         if resp.status_code == 204:
             logger.info(f"{self._prefix}: 单集点格子成功")
-        else:
-            logger.warning(f"{self._prefix}: 单集点格子失败, code={resp.status_code}")
+            return True
+        logger.warning(f"{self._prefix}: 单集点格子失败, code={resp.status_code}")
+        return False
 
     @staticmethod
     def is_anime(path):
@@ -282,7 +678,35 @@ class BangumiSync(_PluginBase):
         pass
 
     def get_api(self) -> List[Dict[str, Any]]:
-        pass
+        return [
+            {
+                "path": "/backfill",
+                "endpoint": self.api_backfill,
+                "methods": ["GET"],
+                "summary": "导入历史记录",
+                "description": "开始导入媒体服务器的历史观看记录，返回导入进度"
+            }
+        ]
+
+    def api_backfill(self, start: bool = False):
+        """
+        API: 导入历史记录，start=true 时开始导入
+        """
+        if start:
+            if not self._enable:
+                return {"code": 400, "message": "插件未启用"}
+            if not self._user:
+                return {"code": 400, "message": "未设置媒体服务器用户名"}
+            self.start_backfill()
+        progress = self.get_data("backfill") or {}
+        return {"code": 0, "data": {
+            "running": bool(self._backfill_thread and self._backfill_thread.is_alive()),
+            "done": len(progress.get("done") or []),
+            "total": progress.get("total", 0),
+            "failed": progress.get("failed", 0),
+            "finished": progress.get("finished", False),
+            "time": progress.get("time")
+        }}
 
     def get_form(self) -> Tuple[List[dict], Dict[str, Any]]:
         return [
@@ -307,6 +731,21 @@ class BangumiSync(_PluginBase):
                                         }
                                     }
                                 ]
+                            }, {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VSwitch',
+                                        'props': {
+                                            'model': 'backfill',
+                                            'label': '导入历史观看记录',
+                                        }
+                                    }
+                                ]
                             }
                         ]
                     },
@@ -347,6 +786,27 @@ class BangumiSync(_PluginBase):
                                 ]
                             }
                         ]
+                    }, {
+                        'component': 'VRow',
+                        'content': [
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextarea',
+                                        'props': {
+                                            'model': 'mapping',
+                                            'rows': 3,
+                                            'label': '手动映射',
+                                            'placeholder': '识别错误的番剧手动指定条目，一行一个，格式：媒体库标题#季#bgm subject_id'
+                                        }
+                                    }
+                                ]
+                            }
+                        ]
                     }, {
                         'component': 'VRow',
                         'content': [
@@ -377,7 +837,9 @@ class BangumiSync(_PluginBase):
         ], {
             "enable": False,
             "user": "",
-            "token": ""
+            "token": "",
+            "mapping": "",
+            "backfill": False
         }
 
     def get_page(self) -> List[dict]:
@@ -390,14 +852,32 @@ class BangumiSync(_PluginBase):
         self.update_config({
             "enable": self._enable,
             "user": self._user,
-            "token": self._token
+            "token": self._token,
+            "mapping": self._mapping,
+            "backfill": self._backfill
         })
 
     def get_state(self) -> bool:
         return self._enable
 
     def stop_service(self):
-        pass
+        if self._worker_stop:
+            self._worker_stop.set()
+            with self._pending_cond:
+                self._pending_cond.notify_all()
+        if self._worker and self._worker.is_alive():
+            self._worker.join(timeout=5)
+        self._worker = None
+        if self._backfill_stop:
+            self._backfill_stop.set()
+        if self._backfill_thread and self._backfill_thread.is_alive():
+            self._backfill_thread.join(timeout=BangumiSync.BACKFILL_INTERVAL + 5)
+        # 超时仍在运行的导入保留引用，结束前不会启动新的导入
+        if self._backfill_thread and not self._backfill_thread.is_alive():
+            self._backfill_thread = None
+        for session in (self._tmdb_request, self._media_request):
+            if session:
+                session.close()
 
 
 if __name__ == "__main__":
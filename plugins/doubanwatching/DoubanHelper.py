@@ -1,152 +1,168 @@
-import re
-from typing import List, Tuple
-from urllib.parse import unquote
+from typing import Tuple
 
 import requests
-from bs4 import BeautifulSoup
+from requests.cookies import remove_cookie_by_name
 from http.cookies import SimpleCookie
 from app.core.config import settings
 from app.core.meta import MetaBase
 from app.helper.cookiecloud import CookieCloudHelper
 from app.log import logger
-from app.utils.http import RequestUtils
+from app.plugins.doubanwatching.SearchParser import PREFIX_SIZE, parse_search
 
 
 class DoubanHelper:
+    """
+    豆瓣请求，插件内长期复用，ck缓存到请求提示登录失效为止
+    """
 
-    def __init__(self, user_cookie: str = None):
-        if not user_cookie:
-            self.cookiecloud = CookieCloudHelper()
-            cookie_dict, msg = self.cookiecloud.download()
-            if cookie_dict is None:
-                logger.error(f"获取cookiecloud数据错误 {msg}")
-            self.cookies = cookie_dict.get("douban.com")
-        else:
-            self.cookies = user_cookie
-        self.cookies = {k: v.value for k, v in SimpleCookie(self.cookies).items()}
+    # 连接、读取超时（秒）
+    TIMEOUT = (5, 15)
 
-        self.headers = {
+    def __init__(self, user_cookie: str = None):
+        self.user_cookie = user_cookie
+        self.session = requests.Session()
+        self.session.headers.update({
             'User-Agent': settings.USER_AGENT,
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Encoding': 'gzip, deflate, sdch',
+            'Accept-Encoding': 'gzip, deflate',
             'Accept-Language': 'zh-CN,zh;q=0.8,en-US;q=0.6,en;q=0.4,en-GB;q=0.2,zh-TW;q=0.2',
             'Connection': 'keep-alive',
-            'DNT': '1',
-            'HOST': 'www.douban.com'
-        }
+            'DNT': '1'
+        })
+        self.cookies = {}
+        self.ck = None
+        self.load_cookies()
+
+    def load_cookies(self):
+        """
+        读取插件配置或cookiecloud的cookie，仅在创建和ck失效时调用
+        """
+        cookies = self.user_cookie
+        if not cookies:
+            cookie_dict, msg = CookieCloudHelper().download()
+            if cookie_dict is None:
+                logger.error(f"获取cookiecloud数据错误 {msg}")
+            cookies = (cookie_dict or {}).get("douban.com")
+        self.cookies = {k: v.value for k, v in SimpleCookie(cookies or "").items()}
 
         self.cookies.pop("__utmz", None)
 
         # 移除用户传进来的comment-key
         self.cookies.pop("ck", None)
 
-        # 获取最新的ck
-        self.set_ck()
-
-        self.ck = self.cookies.get('ck')
-        logger.debug(f"ck:{self.ck} cookie:{self.cookies}")
+        self.session.cookies.clear()
+        for key, value in self.cookies.items():
+            self.session.cookies.set(key, value, domain=".douban.com")
+        self.ck = None
 
         if not self.cookies:
             logger.error(f"cookie获取为空，请检查插件配置或cookie cloud")
+
+    def get_ck(self) -> str:
+        """
+        缓存的ck，没有时请求豆瓣首页获取
+        """
         if not self.ck:
-            logger.error(f"请求ck失败，请检查传入的cookie登录状态")
+            self.set_ck()
+            logger.debug(f"ck:{self.ck} cookie:{self.cookies}")
+            if not self.ck:
+                logger.error(f"请求ck失败，请检查传入的cookie登录状态")
+        return self.ck
 
     def set_ck(self):
-        self.headers["Cookie"] = ";".join([f"{key}={value}" for key, value in self.cookies.items()])
-        response = requests.get("https://www.douban.com/", headers=self.headers)
-        ck_str = response.headers.get('Set-Cookie', '')
-        logger.debug(ck_str)
-        if not ck_str:
-            self.cookies['ck'] = ''
-            return
-        cookie_parts = ck_str.split(";")
-        ck = cookie_parts[0].split("=")[1].strip()
-        logger.debug(ck)
+        remove_cookie_by_name(self.session.cookies, "ck")
+        response = self.session.get("https://www.douban.com/", timeout=self.TIMEOUT)
+        logger.debug(response.headers.get('Set-Cookie', ''))
+        ck = next((cookie.value for cookie in self.session.cookies if cookie.name == "ck"), '')
         if ck == '"deleted"':
-            self.cookies['ck'] = ''
-        else:
-            self.cookies['ck'] = ck
+            ck = ''
+        logger.debug(ck)
+        self.cookies['ck'] = ck
+        self.ck = ck
+
+    def refresh(self):
+        """
+        登录失效时重新读取cookie并获取ck
+        """
+        self.load_cookies()
+        self.get_ck()
+
+    @staticmethod
+    def is_auth_error(response: requests.Response) -> bool:
+        """
+        ck或cookie失效：403，或被重定向到登录、验证页面
+        """
+        if response.status_code in (401, 403):
+            return True
+        return any(host in response.url for host in ("accounts.douban.com", "sec.douban.com"))
 
     def get_subject_id(self, title: str = None, meta: MetaBase = None) -> Tuple | None:
+        """
+        搜索豆瓣条目，找不到时返回 (None, None)
+        登录失效时重新读取cookie和ck后重试一次
+        网络错误、非200响应、被重定向到登录验证页面时抛出 requests.RequestException，由调用方决定是否重试
+        """
         if not title:
             title = meta.title
             year = meta.year
-        url = f"https://www.douban.com/search?cat=1002&q={title}"
-        response = RequestUtils(headers=self.headers).get_res(url)
-        if not response.status_code == 200:
-            logger.error(f"搜索 {title} 失败 状态码：{response.status_code}")
-            return None
-        # self.headers["Cookie"] = response.cookies
-        soup = BeautifulSoup(response.text.encode('utf-8'), 'lxml')
-        title_divs = soup.find_all("div", class_="title")
-        subject_items: List = []
-        # 遍历所有找到的div标签
-        for div in title_divs:
-            item = {}
-
-            # title
-            a_tag = div.find_all("a")[0]
-            item["title"] = a_tag.string
-            item["title"] = item["title"].strip()
-
-            # year 原名:피라미드 게임 / 朴昭妍 / 金知妍 / 2024
-            # span_tag = div.find_all(class_="subject-cast")[0]
-            # year: str = span_tag.string[-4:]
-            # if year.isdigit():
-            #     item["year"] = year
-
-            # subject_id
-            link = unquote(a_tag["href"])
-            if link.count("subject/"):
-                pattern = r"subject/(\d+)/"
-                match = re.search(pattern, link)
-                if match:
-                    subject_id = match.group(1)
-                    item["subject_id"] = subject_id
-            subject_items.append(item)
-
-        if not subject_items:
-            logger.error(f"找不到 {title} 相关条目 搜索结果html:{response.text.encode('utf-8')}")
-        for subject_item in subject_items:
-            logger.debug(f"{subject_item['title']} {subject_item['subject_id']}")
-            return subject_item["title"], subject_item["subject_id"]
-        return None, None
+        response = None
+        for retry in range(2):
+            response = self.session.get("https://www.douban.com/search", params={"cat": "1002", "q": title},
+                                        timeout=self.TIMEOUT)
+            if retry or not self.is_auth_error(response):
+                break
+            logger.warn(f"豆瓣登录状态失效，重新获取cookie和ck")
+            self.refresh()
+        if not response.status_code == 200 or self.is_auth_error(response):
+            raise requests.HTTPError(f"搜索 {title} 失败 状态码：{response.status_code} {response.url}",
+                                     response=response)
+        subject = parse_search(response.text)
+        if not subject:
+            logger.error(f"找不到 {title} 相关条目 搜索结果html:{response.text[:PREFIX_SIZE]}")
+            return None, None
+        logger.debug(f"{subject[0]} {subject[1]}")
+        return subject
 
     def set_watching_status(self, subject_id: str, status: str = "do", private: bool = True) -> bool:
-        self.headers["Referer"] = f"https://movie.douban.com/subject/{subject_id}/"
-        self.headers["Origin"] = "https://movie.douban.com"
-        self.headers["Host"] = "movie.douban.com"
-        self.headers["Cookie"] = ";".join([f"{key}={value}" for key, value in self.cookies.items()])
-        data_json = {
-            "ck": self.ck,
-            "interest": "do",
-            "rating": "",
-            "foldcollect": "U",
-            "tags": "",
-            "comment": ""
+        """
+        标记在看、看过，未开播时返回False
+        网络错误、非200响应时抛出 requests.RequestException，由调用方决定是否重试
+        """
+        headers = {
+            "Referer": f"https://movie.douban.com/subject/{subject_id}/",
+            "Origin": "https://movie.douban.com"
         }
-        if private:
-            data_json["private"] = "on"
-        data_json["interest"] = status
-        response = requests.post(
-            url=f"https://movie.douban.com/j/subject/{subject_id}/interest",
-            headers=self.headers,
-            data=data_json)
-        if not response:
-            logger.error(response.text)
-            return False
-        if response.status_code == 200:
-            # 正常情况 {"r":0}
-            ret = response.json().get("r")
-            r = False if (isinstance(ret, bool) and ret is False) else True
-            if r:
-                return True
+        response = None
+        for retry in range(2):
+            data_json = {
+                "ck": self.get_ck(),
+                "interest": status,
+                "rating": "",
+                "foldcollect": "U",
+                "tags": "",
+                "comment": ""
+            }
+            if private:
+                data_json["private"] = "on"
+            response = self.session.post(
+                url=f"https://movie.douban.com/j/subject/{subject_id}/interest",
+                headers=headers,
+                data=data_json,
+                timeout=self.TIMEOUT)
+            if retry or not self.is_auth_error(response):
+                break
+            logger.warn(f"豆瓣登录状态失效，重新获取cookie和ck")
+            self.refresh()
+        if response.status_code != 200:
+            raise requests.HTTPError(f"douban_id: {subject_id} 标记失败 状态码：{response.status_code} "
+                                     f"{response.text[:200]}", response=response)
+        # 正常情况 {"r":0}
+        ret = response.json().get("r")
+        if isinstance(ret, bool) and ret is False:
             # 未开播 {"r": false}
-            else:
-                logger.error(f"douban_id: {subject_id} 未开播")
-                return False
-        logger.error(response.text)
-        return False
+            logger.error(f"douban_id: {subject_id} 未开播")
+            return False
+        return True
 
 
 if __name__ == "__main__":
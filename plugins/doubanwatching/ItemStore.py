@@ -0,0 +1,170 @@
+import json
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from app.log import logger
+
+# 每个条目一条插件数据
+KEY_PREFIX = "item:"
+# 每个月一条索引 {title: timestamp}
+MONTH_PREFIX = "index:"
+# 有记录的月份列表 ["2024-05", ...]
+MONTHS_KEY = "months"
+# 上一版本所有月份的索引保存在一条数据中
+LEGACY_INDEX_KEY = "index"
+# 旧版本所有条目保存在一条数据中
+LEGACY_KEY = "data"
+
+
+class ItemStore:
+    """
+    已同步条目存储，按标题每个条目一条插件数据，另有按月每月一条的时间索引
+    {
+        "subject_id": "123",
+        "subject_name": "豆瓣标题",
+        "timestamp": "2024-01-01 00:00:00",
+        "poster_path": "https://...",
+        "type": "电视剧"
+    }
+    """
+
+    def __init__(self, plugin):
+        self._plugin = plugin
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(title: str) -> str:
+        return f"{KEY_PREFIX}{title}"
+
+    @staticmethod
+    def _month_key(month: str) -> str:
+        return f"{MONTH_PREFIX}{month}"
+
+    @staticmethod
+    def _month(timestamp: str) -> str:
+        return (timestamp or "")[:7]
+
+    def get(self, title: str) -> dict:
+        return self._plugin.get_data(self._key(title)) or {}
+
+    def month_index(self, month: str) -> Dict[str, str]:
+        return self._plugin.get_data(self._month_key(month)) or {}
+
+    def upsert(self, title: str, item: dict):
+        """
+        保存单个条目，只在月份或时间变化时更新所在月份的索引
+        """
+        with self._lock:
+            old_month = self._month(self.get(title).get("timestamp"))
+            month, timestamp = self._month(item.get("timestamp")), item.get("timestamp")
+            self._plugin.save_data(self._key(title), item)
+            months = self._months()
+            months_changed = False
+            if old_month and old_month != month:
+                old_index = self.month_index(old_month)
+                if old_index.pop(title, None) is not None:
+                    self._save_month(old_month, old_index)
+                    if not old_index and old_month in months:
+                        months.remove(old_month)
+                        months_changed = True
+            index = self.month_index(month)
+            if index.get(title) != timestamp:
+                index[title] = timestamp
+                self._save_month(month, index)
+            if month not in months:
+                months.append(month)
+                months_changed = True
+            if months_changed:
+                self._plugin.save_data(MONTHS_KEY, sorted(months))
+
+    def months(self) -> List[str]:
+        """
+        有记录的月份，从新到旧
+        """
+        return sorted(self._months(), reverse=True)
+
+    def items_in_months(self, months: List[str]) -> List[dict]:
+        """
+        读取指定月份的条目，按时间从新到旧，每个条目附带title
+        """
+        titles = sorted(((timestamp, title) for month in months for title, timestamp in
+                         self.month_index(month).items()), reverse=True)
+        items = []
+        for _, title in titles:
+            item = self.get(title)
+            if item:
+                items.append(dict(item, title=title))
+        return items
+
+    def recent(self, month_count: int) -> List[dict]:
+        """
+        最近month_count个有记录的月份的条目
+        """
+        return self.items_in_months(self.months()[:max(0, month_count)])
+
+    def missing_posters(self) -> List[Tuple[str, dict]]:
+        """
+        没有海报的条目，一次查询读取全部数据
+        """
+        return [(key[len(KEY_PREFIX):], value) for key, value in self._all_data()
+                if key.startswith(KEY_PREFIX) and isinstance(value, dict) and not value.get("poster_path")]
+
+    def migrate_legacy(self) -> Optional[int]:
+        """
+        旧版本所有条目保存在一条data中，拆分为每个条目一条；
+        上一版本的整体月份索引拆分为每月一条
+        """
+        legacy_index = self._plugin.get_data(LEGACY_INDEX_KEY)
+        if isinstance(legacy_index, dict):
+            with self._lock:
+                self._merge_months(legacy_index)
+                self._plugin.del_data(LEGACY_INDEX_KEY)
+            logger.info(f"已拆分 {len(legacy_index)} 个月的同步记录索引")
+        legacy = self._plugin.get_data(LEGACY_KEY)
+        if not isinstance(legacy, dict):
+            return None
+        with self._lock:
+            index: Dict[str, Dict[str, str]] = {}
+            for title, item in legacy.items():
+                if not isinstance(item, dict) or not item.get("timestamp"):
+                    continue
+                index.setdefault(self._month(item.get("timestamp")), {})[title] = item.get("timestamp")
+                self._plugin.save_data(self._key(title), item)
+            # 旧版本数据按标题唯一，每个月的索引只写一次
+            self._merge_months(index)
+            self._plugin.del_data(LEGACY_KEY)
+        logger.info(f"已迁移 {len(legacy)} 条旧版本同步记录")
+        return len(legacy)
+
+    def _months(self) -> List[str]:
+        return self._plugin.get_data(MONTHS_KEY) or []
+
+    def _save_month(self, month: str, index: Dict[str, str]):
+        if index:
+            self._plugin.save_data(self._month_key(month), index)
+        else:
+            self._plugin.del_data(self._month_key(month))
+
+    def _merge_months(self, index: Dict[str, Dict[str, str]]):
+        """
+        批量合并多个月份的索引，每个月份与月份列表各写一次
+        """
+        months = set(self._months())
+        for month, titles in index.items():
+            if not titles:
+                continue
+            month_index = self.month_index(month)
+            month_index.update(titles)
+            self._save_month(month, month_index)
+            months.add(month)
+        self._plugin.save_data(MONTHS_KEY, sorted(months))
+
+    def _all_data(self):
+        for data in self._plugin.get_data() or []:
+            value = data.value
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            yield data.key, value
@@ -0,0 +1,70 @@
+import html
+import re
+from typing import List, Optional, Tuple
+from urllib.parse import unquote
+
+# 快速解析只看响应的前这么多字符，第一个结果在页头的样式、脚本、导航之后
+PREFIX_SIZE = 128 * 1024
+
+SUBJECT_ID_RE = re.compile(r"subject/(\d+)/")
+# 结果标题div中的第一个链接，不跨越下一个div
+TITLE_LINK_RE = re.compile(
+    r'<div\s+class="(?:[^"]*\s)?title(?:\s[^"]*)?"\s*>'
+    r'(?:(?!<div)[\s\S])*?'
+    r'<a\s[^>]*?href="([^"]*)"[^>]*>([\s\S]*?)</a>')
+TAG_RE = re.compile(r"<[^>]+>")
+
+
+def subject_id_from_link(link: str) -> Optional[str]:
+    """
+    搜索结果链接为豆瓣跳转链接，subject地址在url参数中
+    """
+    match = SUBJECT_ID_RE.search(unquote(html.unescape(link)))
+    return match.group(1) if match else None
+
+
+def parse_first_subject(text: str, prefix_size: int = PREFIX_SIZE) -> Optional[Tuple[str, str]]:
+    """
+    快速解析：在响应前缀中正则查找第一个带subject链接的结果，找到即停止
+    :return: (标题, subject_id)，前缀中找不到时返回None，由调用方回退完整解析
+    """
+    for match in TITLE_LINK_RE.finditer(text, 0, prefix_size):
+        subject_id = subject_id_from_link(match.group(1))
+        if subject_id:
+            title = html.unescape(TAG_RE.sub("", match.group(2))).strip()
+            return title, subject_id
+    return None
+
+
+def parse_subjects(text: str) -> List[dict]:
+    """
+    完整解析：BeautifulSoup构建整个页面，返回全部结果 [{"title", "subject_id"}]
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(text, 'lxml')
+    subject_items: List[dict] = []
+    # 遍历所有找到的div标签
+    for div in soup.find_all("div", class_="title"):
+        a_tags = div.find_all("a")
+        if not a_tags:
+            continue
+        item = {"title": a_tags[0].get_text().strip()}
+        subject_id = subject_id_from_link(a_tags[0].get("href", ""))
+        if subject_id:
+            item["subject_id"] = subject_id
+        subject_items.append(item)
+    return subject_items
+
+
+def parse_search(text: str) -> Optional[Tuple[str, str]]:
+    """
+    第一个带subject_id的结果，先走快速解析，失败再完整解析
+    """
+    subject = parse_first_subject(text)
+    if subject:
+        return subject
+    for item in parse_subjects(text):
+        if item.get("subject_id"):
+            return item["title"], item["subject_id"]
+    return None
@@ -0,0 +1,193 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+from app.log import logger
+
+
+class RateLimiter:
+    """
+    按豆瓣账号限速：两次同步的最小间隔，以及每小时最多同步次数
+    """
+
+    def __init__(self, interval: float = 5, per_hour: int = 60):
+        self._interval = interval
+        self._per_hour = per_hour
+        self._history: Dict[str, Deque[float]] = {}
+
+    def wait_time(self, account: str, reserve: int = 0) -> float:
+        """
+        距离该账号下次允许请求还需等待的秒数
+        :param reserve: 每小时为其他请求保留的次数
+        """
+        now = time.time()
+        history = self._history.setdefault(account, deque())
+        while history and now - history[0] >= 3600:
+            history.popleft()
+        wait = 0.0
+        if history:
+            wait = max(wait, history[-1] + self._interval - now)
+        per_hour = max(1, self._per_hour - reserve)
+        if len(history) >= per_hour:
+            wait = max(wait, history[len(history) - per_hour] + 3600 - now)
+        return wait
+
+    def record(self, account: str):
+        self._history.setdefault(account, deque()).append(time.time())
+
+
+class SyncQueue:
+    """
+    豆瓣同步后台队列，单线程按到期时间执行
+    同一标题的待同步任务用merge合并为一个，执行期间到达的同标题任务在执行结束后与其合并
+    handler正常返回表示任务结束（成功，或条目不存在、未开播等重试也无用的失败），
+    抛出异常表示网络错误、限流等可重试的失败，按指数退避重试
+    低优先级任务（历史导入）只在没有到期的高优先级任务时执行，并为高优先级任务保留每小时的部分次数
+    job: {"key", "account", "title", "status", "priority", ...}
+    """
+
+    # 重试间隔基数（秒）与最多尝试次数
+    RETRY_BASE = 60
+    MAX_ATTEMPTS = 5
+    # 任务优先级，数值小的先执行
+    PRIORITY_HIGH = 0
+    PRIORITY_LOW = 1
+    # 每小时为高优先级任务保留的次数
+    HIGH_PRIORITY_RESERVE = 15
+
+    def __init__(self, handler: Callable[[dict], None], limiter: RateLimiter,
+                 merge: Optional[Callable[[dict, dict], dict]] = None,
+                 on_change: Optional[Callable[[List[dict]], None]] = None):
+        self._handler = handler
+        self._limiter = limiter
+        self._merge = merge
+        self._on_change = on_change
+        self._cond = threading.Condition()
+        self._pending: Dict[str, dict] = {}
+        # 执行中的任务，停止时一并保存
+        self._running: Optional[dict] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(target=self._worker, name="DouBanWatching", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        # 保存一次未完成的任务（含执行中的），之后不再持久化，
+        # 避免等待超时仍在运行的线程覆盖新队列保存的任务
+        self._notify()
+        self._on_change = None
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def put(self, job: dict, persist: bool = True) -> bool:
+        """
+        加入任务，已有同key任务时合并，返回是否为新任务
+        :param persist: 是否立即保存队列，批量加入时由调用方最后调用save
+        """
+        key = job["key"]
+        job.setdefault("due", time.time())
+        job.setdefault("attempts", 0)
+        job.setdefault("priority", self.PRIORITY_HIGH)
+        with self._cond:
+            old_job = self._pending.get(key)
+            self._enqueue(job)
+            self._cond.notify_all()
+        if old_job:
+            logger.info(f"{key} 已在同步队列中，合并任务")
+        if persist:
+            self._notify()
+        return not old_job
+
+    def save(self):
+        """
+        保存队列
+        """
+        self._notify()
+
+    def snapshot(self) -> List[dict]:
+        with self._cond:
+            jobs = list(self._pending.values())
+            if self._running and self._running["key"] not in self._pending:
+                jobs.insert(0, self._running)
+            return [dict(job) for job in jobs]
+
+    def _enqueue(self, job: dict):
+        """
+        放入待处理，已有同key任务时合并，调用方持有锁
+        """
+        old_job = self._pending.get(job["key"])
+        if old_job:
+            due = min(old_job.get("due", 0), job.get("due", 0))
+            priority = min(old_job.get("priority", self.PRIORITY_HIGH), job.get("priority", self.PRIORITY_HIGH))
+            job = self._merge(old_job, job) if self._merge else job
+            # 合并后保留较早的到期时间与较高的优先级，不因新事件推迟
+            job["due"] = due
+            job["priority"] = priority
+        self._pending[job["key"]] = job
+
+    def _notify(self):
+        if self._on_change:
+            try:
+                self._on_change(self.snapshot())
+            except Exception as e:
+                logger.error(f"保存同步队列失败：{str(e)}")
+
+    def _next_job(self) -> Optional[dict]:
+        """
+        取出下一个到期且账号未被限速的任务，优先级高的先执行，没有时等待
+        """
+        with self._cond:
+            while not self._stopping:
+                now = time.time()
+                wait = None
+                for key, job in sorted(self._pending.items(),
+                                       key=lambda kv: (kv[1].get("priority", self.PRIORITY_HIGH),
+                                                       kv[1].get("due", 0))):
+                    reserve = self.HIGH_PRIORITY_RESERVE \
+                        if job.get("priority", self.PRIORITY_HIGH) > self.PRIORITY_HIGH else 0
+                    delay = max(job.get("due", 0) - now,
+                                self._limiter.wait_time(job.get("account", ""), reserve=reserve))
+                    if delay <= 0:
+                        self._running = self._pending.pop(key)
+                        return self._running
+                    wait = delay if wait is None else min(wait, delay)
+                self._cond.wait(timeout=wait)
+        return None
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                break
+            self._limiter.record(job.get("account", ""))
+            succeeded = False
+            try:
+                self._handler(job)
+                succeeded = True
+            except Exception as e:
+                job["attempts"] = job.get("attempts", 0) + 1
+                if job["attempts"] >= self.MAX_ATTEMPTS:
+                    logger.error(f"{job['key']} 同步失败 {job['attempts']} 次，放弃：{str(e)}")
+                else:
+                    delay = self.RETRY_BASE * 2 ** (job["attempts"] - 1)
+                    logger.warn(f"{job['key']} 同步失败，{delay}秒后重试：{str(e)}")
+                    job["due"] = time.time() + delay
+            with self._cond:
+                key = job["key"]
+                pending = self._pending.pop(key, None)
+                retry = not succeeded and job["attempts"] < self.MAX_ATTEMPTS
+                if retry or (succeeded and pending):
+                    self._pending[key] = job
+                if pending:
+                    # 执行期间到达的同key任务与本任务合并，避免看过被在看覆盖
+                    self._enqueue(pending)
+                self._running = None
+            self._notify()
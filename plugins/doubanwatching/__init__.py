@@ -1,19 +1,26 @@
+import hashlib
 import threading
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
+
+import pytz
+import requests
+from apscheduler.schedulers.background import BackgroundScheduler
 from typing import Dict, Any, Optional, Tuple, List
 
 from app.chain.media import MediaChain
+from app.core.config import settings
 from app.core.event import eventmanager, Event
 from app.core.metainfo import MetaInfo
 from app.plugins import _PluginBase
 from app.plugins.doubanwatching.DoubanHelper import DoubanHelper
+from app.plugins.doubanwatching.ItemStore import ItemStore
+from app.plugins.doubanwatching.SyncQueue import RateLimiter, SyncQueue
 from app.schemas import WebhookEventInfo, MediaInfo
 from app.schemas.types import EventType, MediaType
 import re
 from app.log import logger
 
-lock = threading.Lock()
-
 
 class DouBanWatching(_PluginBase):
     # 插件名称
@@ -23,7 +30,7 @@ class DouBanWatching(_PluginBase):
     # 插件图标
     plugin_icon = "douban.png"
     # 插件版本
-    plugin_version = "1.9.4"
+    plugin_version = "1.9.11"
     # 插件作者
     plugin_author = "honue"
     # 作者主页
@@ -41,12 +48,40 @@ class DouBanWatching(_PluginBase):
     _user = ""
     _exclude = ""
     _cookie = ""
+    _mapping = ""
+    _overrides: Dict[str, str] = {}
+    _import_history = False
+    _import_dry_run = False
 
     _pc_month = None
     _pc_num = None
     _mobile_month = None
     _mobile_num = None
 
+    # cookie => DoubanHelper，留空的cookie表示使用cookiecloud
+    _helpers: Dict[str, DoubanHelper] = {}
+    _helper_lock = threading.Lock()
+    _items: ItemStore = None
+    _scheduler: BackgroundScheduler = None
+    # 仪表板按月分组的显示数据，与按布局缓存的时间线
+    _view: Optional[List[dict]] = None
+    _line_items: Dict[bool, List[dict]] = {}
+    # 失效时递增，渲染开始后缓存已失效的结果不再保存
+    _view_generation = 0
+    _view_lock = threading.Lock()
+    # 豆瓣同步后台队列，限速按账号计，插件重载后保留
+    _queue: SyncQueue = None
+    _limiter = RateLimiter(interval=5, per_hour=60)
+    # 历史记录导入
+    _import_thread: threading.Thread = None
+    # 每次导入各自的停止信号，停止超时仍在运行的旧导入不会被新的导入复位
+    _import_stop: threading.Event = None
+
+    # tmdbid+季 => 豆瓣subject_id 映射缓存有效期
+    SUBJECT_TTL = 90 * 24 * 3600
+    # 媒体服务器分页大小
+    IMPORT_PAGE_SIZE = 500
+
     def init_plugin(self, config: dict = None):
         config = config or {}
         self._enable = config.get("enable", False)
@@ -55,6 +90,10 @@ class DouBanWatching(_PluginBase):
         self._user = config.get("user", "")
         self._exclude = config.get("exclude", "")
         self._cookie = config.get("cookie", "")
+        self._mapping = config.get("mapping", "") or ""
+        self._overrides = self.parse_mapping(self._mapping)
+        self._import_history = config.get("import_history", False)
+        self._import_dry_run = config.get("import_dry_run", False)
 
         self._pc_month = int(config.get("pc_month")) if config.get("pc_month", None) else 3
         self._pc_num = int(config.get("pc_num", 50)) if config.get("pc_num", None) else 50
@@ -66,12 +105,38 @@ class DouBanWatching(_PluginBase):
             PluginDataOper().del_data(plugin_id="DouBanWatching")
             logger.warn("检测到本插件旧版本数据，删除旧版本数据，避免报错...")
 
+        self.stop_service()
+
+        self._items = ItemStore(self)
+        self._items.migrate_legacy()
+        self.__invalidate_view()
+
+        # 豆瓣同步队列，恢复上次未完成的任务
+        self._queue = SyncQueue(handler=self.__sync_job, limiter=self._limiter, merge=self.__merge_job,
+                                on_change=lambda jobs: self.save_data("sync_queue", jobs))
+        for job in self.get_data("sync_queue") or []:
+            self._queue.put(job, persist=False)
+        self._queue.start()
+
+        # 导入历史观看记录，开关只生效一次，未完成的进度下次继续
+        if self._enable and self._import_history:
+            self._import_history = False
+            self.__update_config()
+            self.start_import(dry_run=self._import_dry_run)
+
+        # 后台补全缺失的海报，不在仪表板渲染时识别
+        if self._enable:
+            self._scheduler = BackgroundScheduler(timezone=settings.TZ)
+            self._scheduler.add_job(func=self.backfill_posters, trigger='date',
+                                    run_date=datetime.now(tz=pytz.timezone(settings.TZ)) + timedelta(seconds=10),
+                                    name="豆瓣书影音档案补全海报")
+            self._scheduler.start()
+
     @eventmanager.register(EventType.WebhookMessage)
     def sync_log(self, event: Event, played: bool = False):
         event_info: WebhookEventInfo = event.event_data
         play_start = {"playback.start", "media.play", "PlaybackStart"}
         path = event_info.item_path
-        processed_items: Dict = self.get_data('data') or {}
 
         if (event_info.event in play_start and event_info.user_name in self._user.split(',')) or played:
             logger.info(" ")
@@ -83,9 +148,9 @@ class DouBanWatching(_PluginBase):
                 return
 
             if event_info.item_type == "TV":
-                self._process_tv_show(event_info, processed_items, played=played)
+                self._process_tv_show(event_info, played=played)
             else:
-                self._process_movie(event_info, processed_items, played=played)
+                self._process_movie(event_info, played=played)
 
     @eventmanager.register(EventType.WebhookMessage)
     def sync_played(self, event: Event):
@@ -93,10 +158,9 @@ class DouBanWatching(_PluginBase):
         played = {'item.markplayed', 'media.scrobble'}
 
         if event_info.event in played and event_info.user_name in self._user.split(','):
-            with lock:
-                self.sync_log(event=event, played=True)
+            self.sync_log(event=event, played=True)
 
-    def _process_tv_show(self, event_info: WebhookEventInfo, processed_items: Dict, played: bool = False):
+    def _process_tv_show(self, event_info: WebhookEventInfo, played: bool = False):
         index = event_info.item_name.index(" S")
         title = event_info.item_name[:index]
         season_id, episode_id = map(int, [event_info.season_id, event_info.episode_id])
@@ -127,13 +191,13 @@ class DouBanWatching(_PluginBase):
         title = self.format_title(title, season_id)
         status = "collect" if len(episodes) == episode_id else "do"
 
-        if processed_items.get(title) and len(episodes) != episode_id:
+        if self._items.get(title) and len(episodes) != episode_id:
             logger.info(f"{title} 已同步到豆瓣在看，不处理")
             return
 
-        self._sync_to_douban(title, status, event_info, processed_items, mediainfo)
+        self._sync_to_douban(title, status, event_info, mediainfo, season=season_id)
 
-    def _process_movie(self, event_info: WebhookEventInfo, processed_items: Dict, played: bool = False):
+    def _process_movie(self, event_info: WebhookEventInfo, played: bool = False):
         title = event_info.item_name
 
         if not played:
@@ -151,38 +215,374 @@ class DouBanWatching(_PluginBase):
                 logger.error(f'仍然未识别到媒体信息，请检查TMDB网络连接...')
                 return
 
-        if processed_items.get(title):
+        if self._items.get(title):
             logger.info(f"{title} 已同步到豆瓣在看，不处理")
             return
 
-        self._sync_to_douban(title, "collect", event_info, processed_items, mediainfo)
+        self._sync_to_douban(title, "collect", event_info, mediainfo)
 
     def _recognize_media(self, meta: MetaInfo, tmdb_id: Optional[int]) -> Optional[MediaInfo]:
         return MediaChain().recognize_media(meta=meta, mtype=meta.type, tmdbid=tmdb_id, cache=True)
 
-    def _sync_to_douban(self, title: str, status: str, event_info: WebhookEventInfo, processed_items: Dict,
-                        mediainfo: MediaInfo):
+    def _sync_to_douban(self, title: str, status: str, event_info: WebhookEventInfo, mediainfo: MediaInfo,
+                        season: int = 0):
+        """
+        加入后台同步队列，同一标题未同步前的多次事件合并为一次
+        """
+        self._queue.put({
+            "key": title,
+            "account": self.__account(),
+            "title": title,
+            "status": status,
+            "season": season,
+            "tmdb_id": mediainfo.tmdb_id,
+            "poster_path": mediainfo.poster_path,
+            "type": "电视剧" if event_info.item_type == "TV" else "电影"
+        })
+        logger.info(f"{title} 已加入豆瓣同步队列")
+
+    @staticmethod
+    def __merge_job(old_job: dict, new_job: dict) -> dict:
+        """
+        看过优先于在看
+        """
+        if "collect" in (old_job.get("status"), new_job.get("status")):
+            new_job["status"] = "collect"
+        return new_job
+
+    def __account(self) -> str:
+        """
+        限速用的账号标识，不保存cookie本身
+        """
+        if not self._cookie:
+            return "cookiecloud"
+        return hashlib.md5(self._cookie.encode("utf-8")).hexdigest()[:8]
+
+    def __sync_job(self, job: dict):
+        """
+        同步队列的任务处理，条目不存在、未开播时放弃
+        搜索和标记的网络错误、非200响应（含反爬403/429）由DoubanHelper抛出，队列退避重试
+        """
+        title = job["title"]
         logger.info(f"开始尝试获取 {title} 豆瓣id")
-        douban_helper = DoubanHelper(user_cookie=self._cookie)
-        subject_name, subject_id = douban_helper.get_subject_id(title=title)
+        douban_helper = self.get_douban_helper()
+        subject_name, subject_id = self.get_subject(title=title, tmdb_id=job.get("tmdb_id"),
+                                                    season=job.get("season") or 0)
 
-        if subject_id:
-            logger.info(f"查询：{title} => 匹配豆瓣：{subject_name} https://movie.douban.com/subject/{subject_id}/")
-            ret = douban_helper.set_watching_status(subject_id=subject_id, status=status, private=self._private)
-            if ret:
-                processed_items[title] = {
-                    "subject_id": subject_id,
-                    "subject_name": subject_name,
-                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "poster_path": mediainfo.poster_path,
-                    "type": "电视剧" if event_info.item_type == "TV" else "电影"
-                }
-                self.save_data('data', processed_items)
-                logger.info(f"{title} 同步到档案成功")
-            else:
-                logger.info(f"{title} 同步到档案失败")
+        if not subject_id:
+            logger.warn(f"获取 {title} subject_id 失败，本条目不存在于豆瓣")
+            return
+        logger.info(f"查询：{title} => 匹配豆瓣：{subject_name} https://movie.douban.com/subject/{subject_id}/")
+        ret = douban_helper.set_watching_status(subject_id=subject_id, status=job["status"], private=self._private)
+        if not ret:
+            logger.info(f"{title} 同步到档案失败")
+            return
+        self._items.upsert(title, {
+            "subject_id": subject_id,
+            "subject_name": subject_name,
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "poster_path": job.get("poster_path"),
+            "type": job.get("type"),
+            "status": job["status"]
+        })
+        self.__invalidate_view()
+        logger.info(f"{title} 同步到档案成功")
+
+    def start_import(self, dry_run: bool = False) -> bool:
+        """
+        后台导入媒体服务器的历史观看记录，dry_run时只生成报告不同步
+        """
+        if self._import_thread and self._import_thread.is_alive():
+            logger.info("豆瓣历史记录导入正在进行中")
+            return False
+        self._import_stop = threading.Event()
+        self._import_thread = threading.Thread(target=self.__import_history, args=(self._import_stop, dry_run),
+                                               name="DouBanWatching-import", daemon=True)
+        self._import_thread.start()
+        return True
+
+    def __import_history(self, stop: threading.Event, dry_run: bool = False):
+        """
+        读取媒体服务器已播放的电影和剧集，剧集按季取看过的最大集数，经映射缓存和同步队列同步到豆瓣
+        进度保存在插件数据中，中断后再次执行会跳过已处理的条目
+        """
+        progress: Dict[str, Any] = self.get_data("import") or {}
+        if progress.get("finished") or progress.get("dry_run") != dry_run:
+            progress = {}
+        done = set(progress.get("done") or [])
+        report: List[dict] = progress.get("report") or []
+
+        entries = self.__collect_history()
+        todo = [title for title in entries if title not in done]
+        logger.info(f"豆瓣历史记录导入{'（试运行）' if dry_run else ''}：共{len(entries)}个条目，"
+                    f"已处理{len(entries) - len(todo)}个")
+        mapping: Dict[str, dict] = self.get_data("subject_mapping") or {}
+        queue = self._queue
+
+        def save_progress(finished: bool = False):
+            # 导入的任务加入队列时不逐条保存，随进度一起保存
+            if not dry_run:
+                queue.save()
+            self.save_data("import", {
+                "done": list(done),
+                "total": len(entries),
+                "dry_run": dry_run,
+                "finished": finished,
+                "report": report,
+                "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            })
+
+        for idx, title in enumerate(todo):
+            if stop.is_set():
+                save_progress()
+                logger.info("豆瓣历史记录导入中断，下次继续")
+                return
+            report.append(self.__import_entry(entries[title], mapping, dry_run))
+            done.add(title)
+            if (idx + 1) % 20 == 0:
+                save_progress()
+                logger.info(f"豆瓣历史记录导入进度 {idx + 1}/{len(todo)}")
+        save_progress(finished=True)
+        actions = {}
+        for line in report:
+            actions[line["action"]] = actions.get(line["action"], 0) + 1
+        logger.info(f"豆瓣历史记录导入完成：{actions}")
+
+    def __import_entry(self, entry: dict, mapping: Dict[str, dict], dry_run: bool) -> dict:
+        """
+        处理一个待导入条目，返回报告行
+        """
+        title = entry["title"]
+        line = {"title": title, "type": entry["type"], "season": entry["season"], "episode": entry["episode"]}
+        existing = self._items.get(title)
+        if existing and existing.get("status", "collect" if entry["type"] == "电影" else "do") == "collect":
+            return dict(line, status="collect", action="skip", reason="已同步为看过")
+
+        meta = MetaInfo(entry["name"])
+        meta.type = MediaType(entry["type"])
+        if entry["season"]:
+            meta.begin_season = entry["season"]
+        mediainfo = self._recognize_media(meta, entry["tmdb_id"])
+        if not mediainfo and entry["tmdb_id"]:
+            meta.tmdbid = None
+            mediainfo = self._recognize_media(meta, None)
+        if not mediainfo:
+            return dict(line, action="skip", reason="未识别到媒体信息")
+
+        if entry["type"] == "电影":
+            status = "collect"
         else:
-            logger.warn(f"获取 {title} subject_id 失败，本条目不存在于豆瓣，或请检查cookie")
+            episodes = mediainfo.seasons.get(entry["season"], [])
+            status = "collect" if len(episodes) == entry["episode"] else "do"
+        line["status"] = status
+        if existing and existing.get("status", "do") == status:
+            return dict(line, action="skip", reason="已同步")
+
+        subject_name, subject_id, source = self.lookup_subject(title, mediainfo.tmdb_id, entry["season"],
+                                                               mapping=mapping)
+        line.update({"subject_id": subject_id, "subject_name": subject_name, "source": source or "search"})
+        if dry_run:
+            return dict(line, action="dry_run")
+        self._queue.put({
+            "key": title,
+            "account": self.__account(),
+            "title": title,
+            "status": status,
+            "season": entry["season"],
+            "tmdb_id": mediainfo.tmdb_id,
+            "poster_path": mediainfo.poster_path,
+            "type": entry["type"],
+            # 导入任务优先级低于播放事件，不阻塞新的同步
+            "priority": SyncQueue.PRIORITY_LOW
+        }, persist=False)
+        return dict(line, action="queued")
+
+    def __collect_history(self) -> Dict[str, dict]:
+        """
+        所有用户已播放的条目，标题 => {"title", "name", "type", "tmdb_id", "season", "episode"}
+        标题与播放事件的格式一致：剧集为 剧名 第N季，电影为 片名 (年份)
+        """
+        host, api_key = self.__media_server()
+        if not host:
+            logger.warn("未配置Emby/Jellyfin，无法导入历史记录")
+            return {}
+        entries: Dict[str, dict] = {}
+        with requests.Session() as session:
+            for user in self._user.split(','):
+                items, series_tmdb = self.get_played_items(session, host, api_key, user)
+                for item in items:
+                    if not self.exclude_keyword(path=item.get("Path"), keywords=self._exclude).get("ret", False):
+                        continue
+                    if item.get("Type") == "Movie":
+                        name = item.get("Name")
+                        title = f"{name} ({item.get('ProductionYear')})" if item.get("ProductionYear") else name
+                        entries.setdefault(title, {"title": title, "name": name, "type": "电影", "season": 0,
+                                                   "episode": 0,
+                                                   "tmdb_id": self.__tmdb_id(item)})
+                        continue
+                    season, episode = item.get("ParentIndexNumber"), item.get("IndexNumber")
+                    if season is None or episode is None or not item.get("SeriesName"):
+                        continue
+                    title = self.format_title(item.get("SeriesName"), season)
+                    entry = entries.setdefault(title, {"title": title, "name": item.get("SeriesName"),
+                                                       "type": "电视剧", "season": season, "episode": 0,
+                                                       "tmdb_id": series_tmdb.get(item.get("SeriesId"))})
+                    entry["episode"] = max(entry["episode"], episode)
+        if self._first:
+            entries = {title: entry for title, entry in entries.items()
+                       if entry["type"] == "电影" or entry["episode"] >= 2}
+        return entries
+
+    def get_played_items(self, session: requests.Session, host: str, api_key: str,
+                         user_name: str) -> Tuple[List[dict], Dict[str, Optional[int]]]:
+        """
+        媒体服务器中用户已播放的电影、剧集，以及剧集所属剧的tmdbid
+        """
+        try:
+            users = session.get(f"{host}Users", params={"api_key": api_key}, timeout=30)
+            user_id = next((user.get("Id") for user in (users.json() if users.ok else [])
+                            if user.get("Name") == user_name), None)
+            if not user_id:
+                logger.warn(f"媒体服务器中未找到用户 {user_name}")
+                return [], {}
+            items = []
+            while True:
+                res = session.get(f"{host}Users/{user_id}/Items", params={
+                    "api_key": api_key,
+                    "Recursive": "true",
+                    "IncludeItemTypes": "Movie,Episode",
+                    "IsPlayed": "true",
+                    "Fields": "Path,ProviderIds,ProductionYear",
+                    "StartIndex": len(items),
+                    "Limit": self.IMPORT_PAGE_SIZE
+                }, timeout=60)
+                if not res.ok:
+                    logger.warn(f"获取媒体服务器播放记录失败, code={res.status_code}")
+                    break
+                page = res.json().get("Items") or []
+                items += page
+                if len(page) < self.IMPORT_PAGE_SIZE:
+                    break
+            # 剧集的ProviderIds是单集的，按剧批量查询剧的tmdbid
+            series_ids = list({item.get("SeriesId") for item in items if item.get("SeriesId")})
+            series_tmdb = {}
+            for start in range(0, len(series_ids), 100):
+                res = session.get(f"{host}Users/{user_id}/Items", params={
+                    "api_key": api_key,
+                    "Ids": ",".join(series_ids[start:start + 100]),
+                    "Fields": "ProviderIds"
+                }, timeout=60)
+                if res.ok:
+                    for series in res.json().get("Items") or []:
+                        series_tmdb[series.get("Id")] = self.__tmdb_id(series)
+            return items, series_tmdb
+        except requests.RequestException as e:
+            logger.warn(f"连接媒体服务器失败：{str(e)}")
+            return [], {}
+
+    @staticmethod
+    def __tmdb_id(item: dict) -> Optional[int]:
+        tmdb_id = str((item.get("ProviderIds") or {}).get("Tmdb") or "")
+        return int(tmdb_id) if tmdb_id.isdigit() else None
+
+    @staticmethod
+    def __media_server() -> Tuple:
+        """
+        (地址, api_key)，优先Emby
+        """
+        for host, api_key, prefix in [(getattr(settings, "EMBY_HOST", None), getattr(settings, "EMBY_API_KEY", None),
+                                       "emby/"),
+                                      (getattr(settings, "JELLYFIN_HOST", None),
+                                       getattr(settings, "JELLYFIN_API_KEY", None), "")]:
+            if host and api_key:
+                host = host if host.startswith("http") else f"http://{host}"
+                return f"{host.rstrip('/')}/{prefix}", api_key
+        return None, None
+
+    def __update_config(self):
+        """
+        更新配置
+        """
+        self.update_config({
+            "enable": self._enable,
+            "private": self._private,
+            "first": self._first,
+            "user": self._user,
+            "exclude": self._exclude,
+            "cookie": self._cookie,
+            "mapping": self._mapping,
+            "import_history": self._import_history,
+            "import_dry_run": self._import_dry_run,
+            "pc_month": self._pc_month,
+            "pc_num": self._pc_num,
+            "mobile_month": self._mobile_month,
+            "mobile_num": self._mobile_num
+        })
+
+    @staticmethod
+    def parse_mapping(mapping: str) -> Dict[str, str]:
+        """
+        手动映射，每行 tmdbid#季#豆瓣id，电影季填0
+        """
+        overrides = {}
+        for line in mapping.split("\n"):
+            parts = [part.strip() for part in line.strip().split("#")]
+            if len(parts) != 3 or not all(part.isdigit() for part in parts):
+                if line.strip():
+                    logger.warn(f"豆瓣手动映射格式错误，已忽略：{line}")
+                continue
+            overrides[f"{parts[0]}|{int(parts[1])}"] = parts[2]
+        return overrides
+
+    @staticmethod
+    def __subject_key(title: str, tmdb_id: Optional[int], season: int = 0) -> str:
+        return f"{tmdb_id}|{season or 0}" if tmdb_id else f"{title}|{season or 0}"
+
+    def lookup_subject(self, title: str, tmdb_id: Optional[int], season: int = 0,
+                       mapping: Dict[str, dict] = None) -> Tuple:
+        """
+        只查手动映射和持久化缓存，不请求豆瓣
+        :return: (豆瓣标题, subject_id, 来源)，未命中时为 (None, None, None)
+        """
+        key = self.__subject_key(title, tmdb_id, season)
+        if key in self._overrides:
+            return title, self._overrides[key], "override"
+        if mapping is None:
+            mapping = self.get_data("subject_mapping") or {}
+        cached_subject = mapping.get(key)
+        if cached_subject and time.time() - cached_subject.get("time", 0) < self.SUBJECT_TTL:
+            return cached_subject.get("subject_name"), cached_subject.get("subject_id"), "cache"
+        return None, None, None
+
+    def get_subject(self, title: str, tmdb_id: Optional[int], season: int = 0) -> Tuple:
+        """
+        (豆瓣标题, subject_id)，依次查找手动映射、持久化缓存、豆瓣搜索
+        """
+        subject_name, subject_id, source = self.lookup_subject(title, tmdb_id, season)
+        if subject_id:
+            logger.info(f"{title} 使用{'手动映射' if source == 'override' else '缓存'}豆瓣id {subject_id}")
+            return subject_name, subject_id
+        subject_name, subject_id = self.get_douban_helper().get_subject_id(title=title)
+        if subject_id:
+            key = self.__subject_key(title, tmdb_id, season)
+            mapping: Dict[str, dict] = self.get_data("subject_mapping") or {}
+            mapping[key] = {"subject_name": subject_name, "subject_id": subject_id, "title": title,
+                            "time": int(time.time())}
+            self.save_data("subject_mapping", mapping)
+        return subject_name, subject_id
+
+    def get_douban_helper(self) -> DoubanHelper:
+        """
+        按配置的cookie复用DoubanHelper，ck失效时由DoubanHelper自行刷新
+        """
+        with self._helper_lock:
+            helper = self._helpers.get(self._cookie)
+            if not helper:
+                helper = DoubanHelper(user_cookie=self._cookie)
+                # 只保留当前配置的cookie
+                self._helpers.clear()
+                self._helpers[self._cookie] = helper
+            return helper
 
     def get_form(self) -> Tuple[List[dict], Dict[str, Any]]:
         """
@@ -243,6 +643,42 @@ class DouBanWatching(_PluginBase):
                             }
                         ]
                     },
+                    {
+                        'component': 'VRow',
+                        'content': [
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VSwitch',
+                                        'props': {
+                                            'model': 'import_history',
+                                            'label': '导入历史记录',
+                                        }
+                                    }
+                                ]
+                            }, {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 4
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VSwitch',
+                                        'props': {
+                                            'model': 'import_dry_run',
+                                            'label': '导入试运行',
+                                        }
+                                    }
+                                ]
+                            }
+                        ]
+                    },
                     {
                         'component': 'VRow',
                         'content': [
@@ -304,6 +740,29 @@ class DouBanWatching(_PluginBase):
                             }
                         ]
                     },
+                    {
+                        'component': 'VRow',
+                        'content': [
+                            {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                    'md': 12
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VTextarea',
+                                        'props': {
+                                            'model': 'mapping',
+                                            'rows': 3,
+                                            'label': '手动映射',
+                                            'placeholder': '匹配错误的条目手动指定豆瓣id，一行一个，格式：tmdbid#季#豆瓣id，电影季填0',
+                                        }
+                                    }
+                                ]
+                            }
+                        ]
+                    },
                     {
                         'component': 'VRow',
                         'content': [
@@ -423,6 +882,21 @@ class DouBanWatching(_PluginBase):
                                         }
                                     }
                                 ]
+                            }, {
+                                'component': 'VCol',
+                                'props': {
+                                    'cols': 12,
+                                },
+                                'content': [
+                                    {
+                                        'component': 'VAlert',
+                                        'props': {
+                                            'type': 'info',
+                                            'variant': 'tonal',
+                                            'text': 'v1.9.11 支持导入媒体服务器的历史观看记录，保存后执行一次，中断后再次开启会继续；开启试运行只生成报告，不同步到豆瓣。'
+                                        }
+                                    }
+                                ]
                             }
                         ]
                     }
@@ -435,6 +909,9 @@ class DouBanWatching(_PluginBase):
             "user": '',
             "exclude": '',
             "cookie": "",
+            "mapping": "",
+            "import_history": False,
+            "import_dry_run": False,
             "pc_month": 3,
             "pc_num": 50,
             "mobile_month": 2,
@@ -473,134 +950,143 @@ class DouBanWatching(_PluginBase):
 
     def get_line_item(self, mobile: bool = False):
         """
-        processed_items[f"{title}"] = {
-                        "subject_id": subject_id,
-                        "subject_name": subject_name,
-                        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    }
+        仪表板时间线，大屏幕、小屏幕分别缓存，同步记录变化时失效
         """
-        data: Dict = self.get_data('data') or {}
-        content = []
+        with self._view_lock:
+            content = self._line_items.get(mobile)
+            generation = self._view_generation
+        if content is None:
+            content = self.__render_line_item(self.__month_view(generation), mobile=mobile)
+            with self._view_lock:
+                if generation == self._view_generation:
+                    self._line_items[mobile] = content
+        return content
+
+    def __month_view(self, generation: int) -> List[dict]:
+        """
+        按月分组的显示数据，从新到旧，只读取需要显示的月份
+        [{"month": "2024-05", "items": [{"subject_id": "123", "poster_path": "https://..."}]}]
+        """
+        with self._view_lock:
+            view = self._view
+        if view is not None:
+            return view
+        view = []
+        for val in self._items.recent(max(self._pc_month, self._mobile_month)):
+            month = val.get('timestamp', '')[:7]
+            if not view or view[-1]["month"] != month:
+                view.append({"month": month, "items": []})
+            # 海报未补全的条目不显示，月份仍保留
+            poster_path = val.get('poster_path')
+            if not poster_path or poster_path.count('original') < 1:
+                continue
+            view[-1]["items"].append({"subject_id": val.get('subject_id'), "poster_path": poster_path})
+        with self._view_lock:
+            if generation == self._view_generation:
+                self._view = view
+        return view
+
+    def __invalidate_view(self):
+        with self._view_lock:
+            self._view_generation += 1
+            self._view = None
+            self._line_items = {}
 
-        # 按月分组
-        last_month = None
-        current_month_item = None
+    def __render_line_item(self, view: List[dict], mobile: bool = False) -> List[dict]:
+        content = []
         # 限制显示月数
         limit_month = self._mobile_month if mobile else self._pc_month
-        limit_month -= 1
         # 限制每月最多显示数
         limit_num = self._mobile_num if mobile else self._pc_num
-
-        # 将字典按照 timestamp 排序
-        sorted_data = sorted(data.items(),
-                             key=lambda item: datetime.strptime(item[1]['timestamp'], "%Y-%m-%d %H:%M:%S"))
-
-        for key, val in sorted_data[::-1]:
-            if not isinstance(val, dict):
-                continue
-            if not val.get('poster_path', ''):
-                meta = MetaInfo(val.get("subject_name"))
-                meta.type = MediaType("电视剧" if not val.get("type", '') else val.get("type"))
-                # 识别媒体信息
-                mediainfo: MediaInfo = MediaChain().recognize_media(meta=meta, mtype=meta.type,
-                                                                    cache=True)
-                if mediainfo:
-                    poster_path = mediainfo.poster_path
-                else:
-                    continue
-            else:
-                poster_path = val.get('poster_path')
-
-            time_object = datetime.strptime(val.get('timestamp'), "%Y-%m-%d %H:%M:%S")
-
-            if time_object.month != last_month or last_month is None:
-                if limit_month < 1:
-                    break
-                if last_month:
-                    num_movies = len(current_month_item["content"][0]["content"][1]["content"])
-                    current_month_item["content"][0]["content"][0][
-                        "html"] += f"<span class='text-sm font-normal'>看过{num_movies}部</span>"
-                    # 截取limit_num
-                    current_month_item["content"][0]["content"][1]["content"] = \
-                        current_month_item["content"][0]["content"][1]["content"][:limit_num]
-                    content.append(current_month_item)
-                    limit_month -= 1
-
-                # 新的一月
-                # 初始化 current_month_item 模板
-                current_month_item = {
-                    "component": "VTimelineItem",
-                    "props": {
-                        "size": "x-small",
-                    },
-                    "content": [
-                        {
-                            "component": "VCol",
-                            'props': {
-                                'style': 'padding: 0rem 0rem 0rem 0rem'
-                            },
-                            'content': [
-                                {
-                                    'component': 'h1',
-                                    'props': {
-                                        'style': 'padding:0rem 0rem 1rem 0rem;font-weight: bold;',
-                                        'class': 'text-base'
-                                    },
-                                    'html': f"{time_object.month}月 ",
-                                },
-                                {
-                                    'component': 'VRow',
-                                    'props': {
-                                        'style': 'padding: 0rem 0rem 0rem 0rem'
-                                    },
-                                    'content': []
-                                }
-                            ]
-                        }
-                    ]
-                }
-                last_month = time_object.month
-            if not poster_path or (poster_path.count('original') < 1):
-                continue
-            current_month_item["content"][0]["content"][1]["content"].append({
-                "component": "a",
-                'props': {
-                    'href': 'https://www.douban.com/doubanapp/dispatch?uri=/movie/' + val.get(
-                        'subject_id') + '?from=mdouban&open=app',
-                    'target': '_blank',
-                    # 图片卡片间的间距 上 右 下 左
-                    # 'style': 'padding: 1rem 0.5rem 1rem 0.5rem'
-                    'style': 'padding: 0.2rem'
+        for month_view in view[:limit_month]:
+            content.append({
+                "component": "VTimelineItem",
+                "props": {
+                    "size": "x-small",
                 },
                 "content": [
                     {
-                        "component": "VCard",
-                        "props": {
-                            "class": "elevation-4"
+                        "component": "VCol",
+                        'props': {
+                            'style': 'padding: 0rem 0rem 0rem 0rem'
                         },
-                        "content": [
+                        'content': [
                             {
-                                "component": "VImg",
-                                "props": {
-                                    "src": poster_path.replace("/original/", "/w200/"),
-                                    "style": "width:44px; height: 66px;" if mobile else "width:66px; height: 99px;",
-                                    "aspect-ratio": "2/3"
-                                }
+                                'component': 'h1',
+                                'props': {
+                                    'style': 'padding:0rem 0rem 1rem 0rem;font-weight: bold;',
+                                    'class': 'text-base'
+                                },
+                                'html': f"{int(month_view['month'][5:])}月 "
+                                        f"<span class='text-sm font-normal'>看过{len(month_view['items'])}部</span>",
+                            },
+                            {
+                                'component': 'VRow',
+                                'props': {
+                                    'style': 'padding: 0rem 0rem 0rem 0rem'
+                                },
+                                'content': [{
+                                    "component": "a",
+                                    'props': {
+                                        'href': 'https://www.douban.com/doubanapp/dispatch?uri=/movie/' + item.get(
+                                            'subject_id') + '?from=mdouban&open=app',
+                                        'target': '_blank',
+                                        # 图片卡片间的间距 上 右 下 左
+                                        # 'style': 'padding: 1rem 0.5rem 1rem 0.5rem'
+                                        'style': 'padding: 0.2rem'
+                                    },
+                                    "content": [
+                                        {
+                                            "component": "VCard",
+                                            "props": {
+                                                "class": "elevation-4"
+                                            },
+                                            "content": [
+                                                {
+                                                    "component": "VImg",
+                                                    "props": {
+                                                        "src": item["poster_path"].replace("/original/", "/w200/"),
+                                                        "style": "width:44px; height: 66px;" if mobile
+                                                        else "width:66px; height: 99px;",
+                                                        "aspect-ratio": "2/3"
+                                                    }
+                                                }
+                                            ]
+                                        }
+                                    ]
+                                } for item in month_view["items"][:limit_num]]
                             }
                         ]
                     }
                 ]
             })
-
-        if current_month_item:
-            num_movies = len(current_month_item["content"][0]["content"][1]["content"])
-            current_month_item["content"][0]["content"][0][
-                "html"] += f"<span class='text-sm font-normal'>看过{num_movies}部</span>"
-            current_month_item["content"][0]["content"][1]["content"] = \
-                current_month_item["content"][0]["content"][1]["content"][:limit_num]
-            content.append(current_month_item)
         return content
 
+    def backfill_posters(self):
+        """
+        后台补全旧记录缺失的海报，识别失败的条目7天内不再重试
+        """
+        updated = 0
+        now = datetime.now()
+        for title, item in self._items.missing_posters():
+            checked = item.get("poster_checked")
+            if checked and (now - datetime.strptime(checked, "%Y-%m-%d %H:%M:%S")).days < 7:
+                continue
+            meta = MetaInfo(item.get("subject_name") or title)
+            meta.type = MediaType(item.get("type") or "电视剧")
+            # 识别媒体信息
+            mediainfo = self._recognize_media(meta, None)
+            if mediainfo and mediainfo.poster_path:
+                item["poster_path"] = mediainfo.poster_path
+                item.pop("poster_checked", None)
+                updated += 1
+            else:
+                item["poster_checked"] = now.strftime("%Y-%m-%d %H:%M:%S")
+            self._items.upsert(title, item)
+        if updated:
+            logger.info(f"已补全 {updated} 条记录的海报")
+            self.__invalidate_view()
+
     @staticmethod
     def is_mobile(user_agent):
         mobile_keywords = [
@@ -618,14 +1104,57 @@ class DouBanWatching(_PluginBase):
         return self._enable
 
     def stop_service(self):
-        pass
+        if self._import_stop:
+            self._import_stop.set()
+        if self._import_thread and self._import_thread.is_alive():
+            self._import_thread.join(timeout=10)
+        # 超时仍在运行的导入保留引用，结束前不会启动新的导入
+        if self._import_thread and not self._import_thread.is_alive():
+            self._import_thread = None
+        if self._queue:
+            self._queue.stop()
+            self._queue = None
+        if self._scheduler:
+            self._scheduler.remove_all_jobs()
+            if self._scheduler.running:
+                self._scheduler.shutdown()
+            self._scheduler = None
 
     @staticmethod
     def get_command() -> List[Dict[str, Any]]:
         pass
 
     def get_api(self) -> List[Dict[str, Any]]:
-        pass
+        return [
+            {
+                "path": "/import",
+                "endpoint": self.api_import,
+                "methods": ["GET"],
+                "summary": "导入历史记录",
+                "description": "导入媒体服务器的历史观看记录，返回导入进度，report=true时返回报告"
+            }
+        ]
+
+    def api_import(self, start: bool = False, dry_run: bool = False, report: bool = False):
+        """
+        API: 导入历史记录，start=true 时开始导入，dry_run=true 只生成报告不同步
+        """
+        if start:
+            if not self._enable:
+                return {"code": 400, "message": "插件未启用"}
+            self.start_import(dry_run=dry_run)
+        progress = self.get_data("import") or {}
+        data = {
+            "running": bool(self._import_thread and self._import_thread.is_alive()),
+            "dry_run": progress.get("dry_run", False),
+            "done": len(progress.get("done") or []),
+            "total": progress.get("total", 0),
+            "finished": progress.get("finished", False),
+            "time": progress.get("time")
+        }
+        if report:
+            data["report"] = progress.get("report") or []
+        return {"code": 0, "data": data}
 
     @staticmethod
     def exclude_keyword(path: str, keywords: str) -> Dict[str, Any]: